@@ -5,17 +5,35 @@ import data
 import entitydata
 
 #specific imports needed for this module
-import shelve #for save and load
+import savegame #for save and load
 import entities
 import maplevel
 import logging
+import simulation
+import scheduler
+import fovcache
+import components
+import levelcache
+import messagelog
+import tracing
 
 #global class pattern
 class Game(object): 
-    game_msgs = []
-    msg_history = []
+    game_msgs = messagelog.MessageLog()
+    msg_history = messagelog.MessageHistory()
+    entity_sql = None
+    message_sql = None
+    map_layer = None
+    map_layer_key = None
+    panel_key = None
+    fighter_store = None
+    autosaver = None
+    levels = None
+    fov_cache = None
+    map = {}
 
 def game_initialize():
+    tracing.configure() #sink and levels from data.TRACE_*
     libtcod.console_set_custom_font('oryx_tiles3.png', libtcod.FONT_TYPE_GREYSCALE | libtcod.FONT_LAYOUT_TCOD, 32, 12)
     libtcod.console_init_root(data.SCREEN_WIDTH, data.SCREEN_HEIGHT, 'MeFightRogues!', False, libtcod.RENDERER_SDL)
     libtcod.sys_set_fps(data.LIMIT_FPS)
@@ -27,6 +45,7 @@ def game_initialize():
     Game.panel = libtcod.console_new(data.SCREEN_WIDTH, data.PANEL_HEIGHT)
 
     main_menu()
+    tracing.close()
 
 
 #MAIN MENU GAME OPTIONS
@@ -72,34 +91,33 @@ def main_menu():
             break
 
 def save_game(filename='savegame'):
-    #open a new empty shelve (or overwrite old one) to write the game data
-    print 'SYSTEM--\t file saved!'
-    file = shelve.open(filename, 'n')
-    file['map'] = Game.map
-    file['objects'] = Game.objects[Game.dungeon_levelname]
-    file['player_index'] = Game.objects[Game.dungeon_levelname].index(Game.player) #index of player in the objects list
-    file['game_msgs'] = Game.game_msgs
-    file['msg_history'] = Game.msg_history
-    file['game_state'] = Game.game_state
-    file['stairs_index'] = Game.objects[Game.dungeon_levelname].index(Game.stairs)
-    file['dungeon_level'] = Game.player.dungeon_level
-    file.close()
+    #every level goes into its own record in the filename directory. only records that changed get rewritten
+    if Game.autosaver:
+        Game.autosaver.wait() #don't race an autosave still being written
+    written = savegame.save(Game, filename)
+    tracing.trace('SYSTEM', tracing.INFO, None, None, 'file saved! (%d records written)', written)
 
 def load_game(filename='savegame'):
-    file = shelve.open(filename, 'r')
-    Game.map = file['map']
-    Game.objects[Game.dungeon_levelname] = file['objects'] 
-    Game.player = Game.objects[Game.dungeon_levelname][file['player_index']]  #get index of player in the objects list
-    Game.game_msgs = file['game_msgs']
-    Game.msg_history = file['msg_history']
-    Game.game_state = file['game_state']
-    Game.stairs = Game.objects[Game.dungeon_levelname][file['stairs_index']]
-    Game.player.dungeon_level = file['dungeon_level']
-    file.close()
-
-    Game.map[Game.dungeon_levelname].initialize_fov()
-
-def new_game():
+    if Game.autosaver:
+        Game.autosaver.wait()
+    Game.levels = levelcache.LevelCache()
+    savegame.load(Game, filename, Game.levels)
+
+    for levelname in Game.map:
+        Game.map[levelname].initialize_fov()
+    new_rng_streams(Game, Game.seed) #generator state isn't saved. carry on with fresh streams from the game's seed
+    Game.fighter_store = None
+    if data.FIGHTER_STORE:
+        Game.fighter_store = components.FighterStore() #fighters load detached. schedule_all attaches them
+    if Game.fov_cache:
+        Game.fov_cache.clear() #results from the old game are no use, and hold tcod maps
+    Game.fov_cache = fovcache.FovCache()
+    Game.player.fighter.fov_recompute(Game)
+    Game.map_layer = Game.map_layer_key = Game.panel_key = None
+    scheduler.schedule_all(Game)
+    Game.levels.update(Game) #freeze whatever was saved live but is out of range now
+
+def new_game(seed=None):
     #create object representing the player
     fighter_component = entities.Fighter(hp=300, defense=10, power=20, xp=0, xpvalue=0, clan='monster', death_function=entities.player_death, speed = 10)
     Game.player = entities.Object(data.SCREEN_WIDTH/2, data.SCREEN_HEIGHT/2, '@', 'Roguetato', libtcod.white, tilechar=data.TILE_MAGE, blocks=True, fighter=fighter_component)
@@ -110,11 +128,21 @@ def new_game():
 
     Game.dungeon_levelname = data.maplist[Game.player.dungeon_level]
 
+    new_rng_streams(Game, seed)
+    Game.fighter_store = None
+    if data.FIGHTER_STORE:
+        Game.fighter_store = components.FighterStore()
+
+    maplevel.release_levels(Game)
     Game.map = {}
     Game.objects = {}
     Game.upstairs = {}
     Game.downstairs = {}
     Game.tick = 0
+    if Game.fov_cache:
+        Game.fov_cache.clear()
+    Game.fov_cache = fovcache.FovCache()
+    Game.levels = levelcache.LevelCache()
 
     if data.FREE_FOR_ALL_MODE: #turn on SQL junk and kill player.
         Game.entity_sql = logging.Sqlobj(data.ENTITY_DB)
@@ -126,10 +154,12 @@ def new_game():
     #generate map (at this point it's not drawn to screen)
     maplevel.make_dungeon(Game)
     Game.tick = 1
+    scheduler.schedule_all(Game)
 
     Game.fov_recompute = True
-    Game.player.fighter.fov = Game.map[Game.dungeon_levelname].fov_map
+    Game.player.fighter.fov_recompute(Game)
     libtcod.console_clear(Game.con)
+    Game.map_layer = Game.map_layer_key = Game.panel_key = None
 
     #initial equipment
     if not data.AUTOMODE:
@@ -160,6 +190,7 @@ def play_game():
         battleover = False
         Game.fov_recompute = True   
    
+    Game.autosaver = savegame.Autosaver()
     
     while not libtcod.console_is_window_closed():
         libtcod.sys_check_for_event(libtcod.EVENT_KEY_PRESS | libtcod.EVENT_MOUSE, Game.key, Game.mouse)
@@ -181,64 +212,24 @@ def play_game():
 
         #only let player move if speed counter is 0 (or dead).  Don't allow player to move if controlled by AI.
         if not data.AUTOMODE:    
-            if (Game.player.fighter.speed_counter <= 0 and not Game.player.ai) or Game.game_state == data.STATE_DEAD: #player can take a turn-based unless it has an AI         
+            if (Game.player.fighter.next_turn <= Game.tick and not Game.player.ai) or Game.game_state == data.STATE_DEAD: #player can take a turn-based unless it has an AI         
                 Game.player_action = handle_keys()
 
                 if Game.player_action != data.STATE_NOACTION:
-                    #player actually did something. we can reset counter
-                    Game.player.fighter.speed_counter = Game.player.fighter.speed(Game)
+                    #player actually did something. next turn comes around after speed ticks
+                    Game.player.fighter.next_turn = Game.tick + Game.player.fighter.speed(Game)
 
         if Game.player_action == data.STATE_EXIT:
+            Game.autosaver.wait()
             break
 
         #handle monsters only if the game is still playing and the player isn't waiting for an action
         if Game.game_state == data.STATE_PLAYING and Game.player_action != data.STATE_NOACTION:
             Game.fov_recompute = True
             
-            #loop through all objects on all maps
-            for index,Game.dungeon_levelname in enumerate(data.maplist):
-                if index > 0: #skip intro level
-                    for object in Game.objects[Game.dungeon_levelname]:
-                        if object.fighter:
-                            if object.fighter.speed_counter <= 0 and object.fighter.alive: #only allow a turn if the counter = 0. 
-                                if object.ai:
-                                    if object.ai.take_turn(Game): #only reset speed_counter if monster is still alive
-                                        object.fighter.speed_counter = object.fighter.speed(Game)
-
-                            #this is clunky, but have to again check if monster is still alive
-                            if object.fighter.alive:
-                                if object.fighter.regen_counter <= 0: #only regen if the counter = 0. 
-                                    object.fighter.hp += int(object.fighter.max_hp(Game) * data.REGEN_MULTIPLIER)
-                                    object.fighter.regen_counter = object.fighter.regen(Game)
-
-                                object.fighter.regen_counter -= 1
-                                object.fighter.speed_counter -= 1
-                     
-                                if object.fighter.buffs:
-                                    for buff in object.fighter.buffs:
-                                        buff.duration -= buff.decay_rate
-                                        if buff.duration <= 0:
-                                            message(object.name + ' feels the effects of ' + buff.name + ' wear off!', Game, libtcod.light_red)
-                                            object.fighter.remove_buff(buff)
-
-                                #always check to ensure hp <= max_hp
-                                if object.fighter.hp > object.fighter.max_hp(Game):
-                                        object.fighter.hp = object.fighter.max_hp(Game)
-                                        
-                                check_level_up(Game, object)
-
-                            if data.FREE_FOR_ALL_MODE:
-                                # log object state
-                                Game.entity_sql.log_entity(Game, object)
-
-                        elif object.ai:
-                            object.ai.take_turn(Game)
-
-            if data.FREE_FOR_ALL_MODE:
-                Game.entity_sql.log_flush(Game)
-                Game.message_sql.log_flush(Game)            
-                Game.tick += 1
-                Game.sql_commit_counter -= 1
+            simulation.process_tick(Game)
+            Game.autosaver.tick(Game) #between ticks the world is consistent. the disk work happens off this thread
+            Game.levels.tick(Game)
 
             if data.AUTOMODE:
                 alive_entities = entities.total_alive_entities(Game)
@@ -262,40 +253,6 @@ def play_game():
 
         Game.dungeon_levelname = data.maplist[Game.player.dungeon_level]
 
-def check_level_up(Game, user):
-    #see if the user's experience is enough to level-up
-
-        level_up_xp = data.LEVEL_UP_BASE + user.fighter.xplevel * data.LEVEL_UP_FACTOR
-
-        if user.fighter.xp >= level_up_xp:
-            user.fighter.xplevel += 1
-            user.fighter.xp -= level_up_xp
-
-            if user is Game.player:
-                message('You have reached level ' + str(user.fighter.xplevel) + '!', Game, libtcod.yellow)
-            else:
-                message(user.name + ' has reached level ' + str(user.fighter.xplevel) + '!', Game, libtcod.yellow)
-
-            choice = None
-
-            if user is Game.player:
-                while choice == None: #keep asking till a choice is made
-                        choice = menu('Level up! Choose a stat to raise:\n', 
-                        [Menuobj('Constitution (+25 HP, from ' + str(Game.player.fighter.max_hp(Game)) + ')',color=libtcod.green),
-                        Menuobj('Strength (+2 attack, from ' + str(Game.player.fighter.power(Game)) + ')', color=libtcod.red), 
-                        Menuobj('Defense (+2 defense, from ' + str(Game.player.fighter.defense(Game)) + ')', color=libtcod.blue)], data.LEVEL_SCREEN_WIDTH, Game, letterdelim=')')
-            else:
-                choice = libtcod.random_get_int(0,0,2)
-
-            if choice == 0:
-                user.fighter.base_max_hp += 25
-            elif choice == 1:
-                user.fighter.base_power += 2
-            elif choice == 2:
-                user.fighter.base_defense += 2
-
-            user.fighter.hp = user.fighter.max_hp(Game)
-
 #KEYPRESS CHECKS
 def handle_keys():
     #for real-time, uncomment
@@ -347,8 +304,8 @@ def handle_keys():
             #test for other keys
             if key_char == 'g':
                 #pick up an item
-                for object in Game.objects[data.maplist[Game.player.dungeon_level]]: #look for items in the player's title on the same floor of the player
-                    if object.x == Game.player.x and object.y == Game.player.y and object.item:
+                for object in Game.map[data.maplist[Game.player.dungeon_level]].objects_at(Game.player.x, Game.player.y): #look for items in the player's title on the same floor of the player
+                    if object.item:
                         Game.player.game_turns += 1
                         return object.item.pick_up(Game, Game.player)
                         #break
@@ -379,7 +336,7 @@ def handle_keys():
                 msgbox('You start to meditate!', Game, data.CHARACTER_SCREEN_WIDTH)
                 level_up_xp = data.LEVEL_UP_BASE + Game.player.xplevel * data.LEVEL_UP_FACTOR
                 Game.player.fighter.xp = level_up_xp
-                check_level_up(Game)
+                simulation.check_level_up(Game, Game.player)
                 Game.player.game_turns += 1       
 
             if key_char == 'a':
@@ -419,44 +376,31 @@ def handle_keys():
                 width = data.SCREEN_WIDTH
                 height = data.SCREEN_HEIGHT
 
-                history = [[]]
-                count = 0
-                page = 1
-                numpages = int(float(len(Game.msg_history))/data.MAX_NUM_ITEMS + 1)
-
-                for thepage in range(numpages):
-                    history.append([])
-
-                for obj in reversed(Game.msg_history):
-                    line = obj.text
-                    color = obj.color
-                    history[page].append(Menuobj(line, color = color))
-                    count += 1
-
-                    if count >= data.MAX_NUM_ITEMS:
-                        page +=1
-                        count = 0
-
-                for thepage in range(numpages):
+                #pages are wrapped and pulled out of the history one at a time, as they are shown. how many there
+                #are isn't known without wrapping the whole history, so pages are just numbered
+                for (thepage, lines) in enumerate(Game.msg_history.pages(data.MAX_NUM_ITEMS)):
+                    history = [Menuobj(str(turn) + ' : ' + line, color = color) for (turn, line, color) in lines]
                     window = libtcod.console_new(width, height)
                     libtcod.console_print_rect_ex(window, 0, 0, width, height, libtcod.BKGND_NONE, libtcod.LEFT, '')
                     libtcod.console_blit(window, 0, 0, width, height, 0, 0, 0, 1.0, 1)
-                    menu ('Message Log: (Sorted by Most Recent Turn) Page ' + str(thepage+1) + '/' + str(numpages), history[thepage+1], data.SCREEN_WIDTH, Game, letterdelim=None)
+                    menu ('Message Log: (Sorted by Most Recent Turn) Page ' + str(thepage+1), history, data.SCREEN_WIDTH, Game, letterdelim=None)
 
                 Game.fov_recompute = True           
 
 
 
             if key_char == 'r':
-                print 'SYSTEM--\t RELOADING GAME DATA'
+                tracing.trace('SYSTEM', tracing.INFO, None, None, 'RELOADING GAME DATA')
                 reload(data)
                 reload(entitydata) 
+                maplevel.clear_spawn_tables() #chances may have changed
+                entities.clear_prototypes()
                 #update_entities()   #need to find a way to update all objects to current data
                 Game.fov_recompute = True
                 libtcod.console_set_keyboard_repeat(data.KEYS_INITIAL_DELAY,data.KEYS_INTERVAL)
 
                 buff_component = entities.Buff('Super Strength', power_bonus=20)
-                Game.player.fighter.add_buff(buff_component)
+                Game.player.fighter.add_buff(buff_component, Game)
                 msgbox ('YOU ROAR WITH BERSERKER RAGE!', Game, data.CHARACTER_SCREEN_WIDTH)
 
             if key_char == 'w':
@@ -474,7 +418,7 @@ def give_items(Game):
     y = 0
 
     for item in entitydata.items:
-        theitem = entities.Object(**entitydata.items[item])
+        theitem = entities.get_prototype(entitydata.items, item).instantiate()
         theitem.always_visible = True
         Game.player.fighter.add_item(theitem)
 
@@ -492,11 +436,13 @@ def save_final_sql_csv(Game):
                 # log object state
                 Game.entity_sql.log_entity(Game, object)            
 
-        Game.entity_sql.log_flush(Game, force_flush=True)
-        Game.message_sql.log_flush(Game, force_flush=True) 
+        #wait for the writer threads to get everything on disk before exporting
+        Game.entity_sql.close()
+        Game.message_sql.close()
 
         Game.entity_sql.export_csv()
         Game.message_sql.export_csv()
+        Game.entity_sql = Game.message_sql = None
 
 
 if __name__ == '__main__':
@@ -0,0 +1,76 @@
+#standard imports
+import data
+
+#specific imports needed for this module
+import numpy
+
+
+class FighterStore(object):
+    #optional struct-of-arrays home for the fighter state the tick loop churns through. each attached Fighter gets a slot,
+    #and its hp/alive/next_regen properties read and write that slot, so a whole batch of fighters can be updated with
+    #array ops. max_hp and regen are mirrors of the fighters' cached stats, refreshed for the ones marked dirty
+    FIELDS = (('hp', numpy.int32), ('alive', bool), ('next_regen', numpy.int64), ('max_hp', numpy.int32), ('regen', numpy.int32))
+
+    def __init__(self, capacity=data.FIGHTER_STORE_CAPACITY):
+        self.capacity = capacity
+        for (name, dtype) in self.FIELDS:
+            setattr(self, name, numpy.zeros(capacity, dtype=dtype))
+        self.fighters = [None] * capacity #slot -> Fighter
+        self.free = range(capacity - 1, -1, -1) #free slots, lowest handed out first
+        self.dirty = set() #fighters whose max_hp/regen mirror is stale
+
+    def attach(self, fighter):
+        #move a fighter's state into the arrays
+        if fighter.store is self:
+            return
+        if fighter.store is not None:
+            fighter.store.detach(fighter)
+        if not self.free:
+            self.grow()
+
+        (hp, alive, next_regen) = (fighter.hp, fighter.alive, fighter.next_regen)
+        slot = self.free.pop()
+        self.fighters[slot] = fighter
+        fighter.store = self
+        fighter.slot = slot
+        fighter.hp = hp
+        fighter.alive = alive
+        fighter.next_regen = next_regen
+        self.dirty.add(fighter)
+
+    def detach(self, fighter):
+        #copy the state back onto the fighter and free its slot
+        (hp, alive, next_regen) = (fighter.hp, fighter.alive, fighter.next_regen)
+        self.fighters[fighter.slot] = None
+        self.free.append(fighter.slot)
+        self.dirty.discard(fighter)
+        fighter.store = None
+        fighter.slot = None
+        fighter.hp = hp
+        fighter.alive = alive
+        fighter.next_regen = next_regen
+
+    def grow(self):
+        #double the arrays. slots already handed out keep their index
+        old = self.capacity
+        self.capacity *= 2
+        for (name, dtype) in self.FIELDS:
+            array = numpy.zeros(self.capacity, dtype=dtype)
+            array[:old] = getattr(self, name)
+            setattr(self, name, array)
+        self.fighters.extend([None] * old)
+        self.free.extend(range(self.capacity - 1, old - 1, -1))
+
+    def refresh(self, Game):
+        #bring the max_hp/regen mirrors up to date for fighters whose stats changed
+        for fighter in self.dirty:
+            self.max_hp[fighter.slot] = fighter.max_hp(Game)
+            self.regen[fighter.slot] = fighter.regen(Game)
+        self.dirty.clear()
+
+    def regen_batch(self, Game, slots):
+        #one regen step for every slot at once: heal a share of max hp, clamp to max hp, and set the next regen tick
+        self.refresh(Game)
+        hp = self.hp[slots] + (self.max_hp[slots] * data.REGEN_MULTIPLIER).astype(numpy.int32)
+        self.hp[slots] = numpy.minimum(hp, self.max_hp[slots])
+        self.next_regen[slots] = Game.tick + numpy.maximum(1, self.regen[slots])
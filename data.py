@@ -15,6 +15,17 @@ COLOR_LIGHT_GROUND = libtcod.sepia
 FOV_ALGO           = 2 #FOV ALGORITHM. values = 0 to 4
 FOV_LIGHT_WALLS    = True
 TORCH_RADIUS       = 80 #AFFECTS FOV RADIUS
+FOV_CACHE_SIZE     = 64 #HOW MANY COMPUTED FOV RESULTS TO KEEP AROUND FOR REUSE
+FLOW_FIELD_CACHE_SIZE = 16 #HOW MANY MONSTER PATHING MAPS (ONE PER TARGET) TO KEEP PER LEVEL
+SPATIAL_BUCKET_SIZE = 8 #SIZE OF THE GRID CELLS USED TO FIND NEARBY OBJECTS
+RNG_BLOCK_SIZE     = 4096 #HOW MANY RANDOM NUMBERS TO DRAW AT ONCE
+FIGHTER_STORE      = False #KEEP FIGHTER HP/REGEN STATE IN NUMPY ARRAYS AND REGEN IN BATCHES (components.FighterStore)
+FIGHTER_STORE_CAPACITY = 256 #STARTING SIZE OF THE FIGHTER STORE. DOUBLES WHEN FULL
+AUTOSAVE_INTERVAL  = 120 #SECONDS BETWEEN BACKGROUND AUTOSAVES. 0 TURNS AUTOSAVE OFF
+LEVEL_LIVE_DISTANCE = 1 #LEVELS THIS CLOSE TO THE PLAYER'S ARE SIMULATED. FURTHER ONES ARE FROZEN
+LEVEL_EVICT_DISTANCE = 3 #FROZEN LEVELS THIS FAR AWAY ARE WRITTEN TO A SPILL FILE AND DROPPED FROM MEMORY
+LEVEL_EVICT_MINUTES = 5 #...AS ARE LEVELS THAT HAVE BEEN FROZEN THIS LONG
+LEVEL_SPILL_PATH   = 'levelspill' #DIRECTORY FOR EVICTED LEVELS
 
 TILE_WALL          = 256  #first tile in the first row of tiles
 TILE_GROUND        = 256 + 1
@@ -65,6 +76,9 @@ MAX_ROOMS = 2
 ENTITY_DB          = 'entity_stats'
 MESSAGE_DB         = 'game_log'
 SQL_COMMIT_TICK_COUNT = 5
+SQL_QUEUE_SIZE     = 64 #batches waiting for the writer thread before backpressure kicks in
+SQL_QUEUE_POLICY   = 'block' #'block', 'drop-oldest' or 'sample'
+SQL_QUEUE_SAMPLE   = 10 #'sample' keeps one row in this many while the queue is full
 
 #.............................................
 #EDITABLE ENTITIES GENERAL DATA
@@ -75,6 +89,13 @@ ASCIIMODE         = False #use Object.char for graphics if True. use tilechar if
 AUTOMODE          = False
 FREE_FOR_ALL_MODE = True  #if true, all monsters on diffent clans by default
 PRINT_MESSAGES	  = True  #if true, print messages to log
+TRACE_SINK         = 'stream' #WHERE TRACE LINES GO: 'null', 'stream' (stdout), 'file', 'sqlite' OR 'ring' (see tracing.py)
+TRACE_DEFAULT_LEVEL = 10 #10 DEBUG, 20 INFO, 30 WARNING, 40 ERROR, 100 OFF. CATEGORIES NOT IN TRACE_LEVELS USE THIS
+TRACE_LEVELS       = {'MSG': 10, 'MAPGEN': 10, 'SYSTEM': 10} #RAISE MAPGEN TO 20 TO HIDE THE LINE PER MONSTER MADE
+TRACE_FILE         = 'trace.log'
+TRACE_DB           = 'trace.db'
+TRACE_BUFFER_SIZE  = 256 #EVENTS HELD BY THE FILE AND SQLITE SINKS BEFORE THEY WRITE
+TRACE_RING_SIZE    = 1000 #EVENTS KEPT BY THE RING SINK
 TURNBASED         = True #not working yet
 SPEED_DEFAULT     = 5  # speed delay. higher = slower. How many game ticks to wait between turns
 REGEN_DEFAULT     = 100000  # regen delay. higher = slower. How many game ticks to wait between regeneration
@@ -111,6 +132,9 @@ PANEL_Y           = SCREEN_HEIGHT - PANEL_HEIGHT
 MSG_X             = BAR_WIDTH + 2
 MSG_WIDTH         = SCREEN_WIDTH - BAR_WIDTH - 2
 MSG_HEIGHT        = PANEL_HEIGHT - 1
+MSG_HISTORY_SIZE  = 1000 #MESSAGES KEPT IN MEMORY FOR THE LOG VIEWER. OLDER ONES GO TO DISK IN CHUNKS OF HALF THIS
+MSG_HISTORY_PATH  = 'msghistory' #DIRECTORY FOR THOSE CHUNKS. None DROPS THEM INSTEAD
+MSG_HISTORY_MAX_CHUNKS = 100 #CHUNKS KEPT ON DISK. THE OLDEST IS DELETED AFTER THAT
 
 #graphics
 MAIN_MENU_BKG     = 'menu_background.png'
@@ -122,6 +146,11 @@ STATE_DEAD        = 'dead'
 STATE_EXIT        = 'exit'
 STATE_USED        = 'used'
 STATE_CANCELLED   = 'cancelled'
+
+#EVENT STRINGS (things the scheduler can queue up)
+EVENT_TURN        = 'turn'
+EVENT_REGEN       = 'regen'
+EVENT_BUFF        = 'buff'
 #xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx
 
 
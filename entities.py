@@ -2,12 +2,19 @@
 import libtcodpy as libtcod
 from gamestuff import *
 import data
+from scheduler import schedule_buff
+from fovcache import FovHandle
+import tracing
 
 
 #Classes:  Object player, enemies, items, etc
-class Object(object):
+class Object(Slotted):
     #this is a generic object: Game.player, monster, item, stairs
     #always represented by a character on the screen
+    __slots__ = ('name', 'blocks', 'x', 'y', 'char', 'color', 'always_visible', 'dungeon_level', 'tilechar',
+        'fighter', 'caster', 'ai', 'item', 'equipment',
+        'id', 'game_turns', 'entity_id', 'owner') #set from outside: monster id, player turns, sql id, fighter carrying the item
+
     def __init__(self, x=0, y=0, char='?', name=None, color=libtcod.white, tilechar = None, blocks = False, id=None,  dungeon_level=None, always_visible = False, fighter = None, caster = None, ai = None, item = None, equipment = None):
         self.name = name
         self.blocks = blocks
@@ -56,8 +63,7 @@ class Object(object):
 
     def set_location(self, x, y, Game):
         if not is_blocked(x, y, Game):
-            self.x = x
-            self.y = y
+            Game.map[Game.dungeon_levelname].move_object(self, x, y)
             return True
         else:
             return False
@@ -65,19 +71,18 @@ class Object(object):
     def move(self, dx, dy, Game):
         if not is_blocked(self.x + dx, self.y + dy, Game):
         #if not map[self.x + dx][self.y + dy].blocked:
-            self.x += dx
-            self.y += dy
+            Game.map[Game.dungeon_levelname].move_object(self, self.x + dx, self.y + dy)
             return True
         else:
             return False
 
     def move_random(self, Game):
-        self.move(libtcod.random_get_int(0, -1, 1), libtcod.random_get_int(0, -1, 1), Game)
+        self.move(Game.rng_ai.randint(-1, 1), Game.rng_ai.randint(-1, 1), Game)
 
 
     def draw(self, Game):
         #only draw if in field of view of Game.player or it's set to always visible and on explored tile
-        if (libtcod.map_is_in_fov(Game.player.fighter.fov, self.x, self.y) or (self.always_visible and Game.map[Game.dungeon_levelname].explored(self.x, self.y))):
+        if (libtcod.map_is_in_fov(Game.player.fighter.fov_map(Game), self.x, self.y) or (self.always_visible and Game.map[Game.dungeon_levelname].explored(self.x, self.y))):
             (x, y) = to_camera_coordinates(self.x, self.y, Game)
 
             if x is not None:
@@ -91,10 +96,10 @@ class Object(object):
                 libtcod.console_put_char(Game.con, x, y, thechar, libtcod.BKGND_NONE)
 
     def clear(self, Game):
-        #erase char that represents this object
+        #erase char that represents this object by putting back the map tile underneath
         (x, y) = to_camera_coordinates(self.x, self.y, Game)
-        if x is not None and libtcod.map_is_in_fov(Game.player.fighter.fov, self.x, self.y):
-            libtcod.console_put_char_ex(Game.con, x, y, data.GROUND_CHAR, libtcod.white, data.COLOR_LIGHT_GROUND)
+        if x is not None and libtcod.map_is_in_fov(Game.player.fighter.fov_map(Game), self.x, self.y):
+            restore_map_cell(Game, x, y)
 
     def move_away(self, target, Game):
         if self.dungeon_level == target.dungeon_level:
@@ -129,6 +134,13 @@ class Object(object):
 
     def move_towards(self, target, Game):
         if self.dungeon_level == target.dungeon_level:
+            #follow the level's shared flow field toward target. it walks around walls instead of into them
+            step = Game.map[Game.dungeon_levelname].flow_step(self, target)
+            if step is not None:
+                self.move(step[0], step[1], Game)
+                return
+
+            #no free tile gets any closer (boxed in by other monsters). fall back to steering straight at it
             #vector from this object to the target, and distance
             dx1 = target.x - self.x
             dy1 = target.y - self.y
@@ -169,11 +181,18 @@ class Object(object):
         #make this object be drawn first, so all others appear above it if they are in the same tile
         Game.objects[Game.dungeon_levelname].remove(self)
         Game.objects[Game.dungeon_levelname].insert(0, self)
+        Game.map[Game.dungeon_levelname].send_to_back(self)
 
 #fighters, spells, abilities
-class Fighter(object):
+class Fighter(Slotted):
     #combat-related properties and methods (monster, Game.player, NPC, etc)
+    __slots__ = ('base_max_hp', '_hp', 'xp', 'base_defense', 'base_power', 'death_function', 'base_speed', 'next_turn',
+        'base_regen', '_next_regen', 'clan', 'fov', 'fov_handle', 'xpvalue', 'xplevel', '_alive', 'killed', 'kills',
+        'death_tick', 'inventory', 'buffs', 'stats', 'owner', 'store', 'slot')
+
     def __init__(self, hp, defense, power, xp, clan=None, xpvalue=0, alive=True, killed=False, xplevel=1, speed=data.SPEED_DEFAULT, regen=data.REGEN_DEFAULT, death_function=None, buffs=None, inventory=None):
+        self.store = None #components.FighterStore holding hp/alive/next_regen, if attached to one
+        self.slot = None
         self.base_max_hp = hp
         self.hp = hp
         self.xp = xp
@@ -181,15 +200,18 @@ class Fighter(object):
         self.base_power = power
         self.death_function=death_function
         self.base_speed = speed
-        self.speed_counter = 0
+        self.next_turn = 0 #tick of the next turn. the scheduler keeps this up to date
         self.base_regen = regen
-        self.regen_counter = regen
+        self.next_regen = None #tick of the next regen. set when first scheduled
         self.clan = clan
-        self.fov = None
+        self.fov = None #tcod map with this fighter's view. lives in fov_handle
+        self.fov_handle = None
         self.xpvalue = xpvalue
         self.xplevel = xplevel
         self.alive = alive
         self.killed = killed
+        self.kills = 0
+        self.death_tick = None #tick this fighter died on, for battle stats
 
         self.inventory = inventory
         if self.inventory:
@@ -199,8 +221,79 @@ class Fighter(object):
         if self.buffs:
             self.buffs.owner = self
 
+        self.stats = None #derived stats (base + equipment + buffs). rebuilt on demand after invalidate_stats
+
+    #hp, alive and next_regen live in the fighter store's arrays when attached to one, on the fighter otherwise
+    @property
+    def hp(self):
+        if self.store is None:
+            return self._hp
+        return int(self.store.hp[self.slot])
+
+    @hp.setter
+    def hp(self, value):
+        if self.store is None:
+            self._hp = value
+        else:
+            self.store.hp[self.slot] = value
+
+    @property
+    def alive(self):
+        if self.store is None:
+            return self._alive
+        return bool(self.store.alive[self.slot])
+
+    @alive.setter
+    def alive(self, value):
+        if self.store is None:
+            self._alive = value
+        else:
+            self.store.alive[self.slot] = value
+
+    @property
+    def next_regen(self):
+        if self.store is None:
+            return self._next_regen
+        value = int(self.store.next_regen[self.slot])
+        if value < 0:
+            return None
+        return value
+
+    @next_regen.setter
+    def next_regen(self, value):
+        if self.store is None:
+            self._next_regen = value
+        elif value is None:
+            self.store.next_regen[self.slot] = -1
+        else:
+            self.store.next_regen[self.slot] = value
+
+    def __getstate__(self):
+        #saves hold the values, never the store. fighters come back detached
+        state = Slotted.__getstate__(self)
+        (state['_hp'], state['_alive'], state['_next_regen']) = (self.hp, self.alive, self.next_regen)
+        state['store'] = state['slot'] = None
+        state['fov'] = None #a tcod pointer, only good in this process. fov_map() recomputes it
+        return state
+
+    def __setstate__(self, state):
+        self.store = None
+        Slotted.__setstate__(self, state)
+
     def fov_recompute(self, Game):
-        libtcod.map_compute_fov(self.fov, self.owner.x, self.owner.y, data.TORCH_RADIUS, data.FOV_LIGHT_WALLS, data.FOV_ALGO)
+        #no-op if we haven't moved and the map hasn't changed since last time
+        if self.fov_handle is None:
+            self.fov_handle = FovHandle()
+        self.fov = Game.fov_cache.compute(Game, self.fov_handle, Game.dungeon_levelname, self.owner.x, self.owner.y)
+        return self.fov
+
+    def fov_map(self, Game):
+        #this fighter's fov for map_is_in_fov. after a load, restore or clone there is none yet, so it's computed
+        #here (on the fighter's own level) the first time anyone asks
+        if self.fov is None:
+            if self.fov_handle is None:
+                self.fov_handle = FovHandle()
+            self.fov = Game.fov_cache.compute(Game, self.fov_handle, data.maplist[self.owner.dungeon_level], self.owner.x, self.owner.y)
         return self.fov
 
 
@@ -210,55 +303,66 @@ class Fighter(object):
 
         self.inventory.append(item)
         item.owner = self
+        self.invalidate_stats()
 
     def remove_item(self, item):
         try:
             self.inventory.remove(item)
             item.owner = None
+            self.invalidate_stats()
         except:
-            print 'ERROR in remove_item--\t ' + self.owner.name + '/' + item.name
+            tracing.trace('SYSTEM', tracing.ERROR, None, None, 'ERROR in remove_item: %s/%s', self.owner.name, item.name)
 
-    def add_buff(self, buff):
+    def add_buff(self, buff, Game):
         if not self.buffs:
             self.buffs = []
 
         self.buffs.append(buff)
+        self.invalidate_stats()
+        schedule_buff(Game, self.owner, buff)
 
     def remove_buff(self, buff):
         self.buffs.remove(buff)
+        self.invalidate_stats()
 
-    def regen(self, Game):
-        bonus = sum(equipment.regen_bonus for equipment in get_all_equipped(self.owner, Game))
+    def invalidate_stats(self):
+        #call whenever base stats, equipped items or buffs change
+        self.stats = None
+        if self.store is not None:
+            self.store.dirty.add(self)
+
+    def update_stats(self, Game):
+        #walk equipment and buffs once and remember every derived stat
+        equipped = get_all_equipped(self.owner, Game)
         if self.buffs:
-            bonus += sum(buff.regen_bonus for buff in self.buffs)
-        return self.base_regen + bonus
+            equipped = equipped + self.buffs
+
+        self.stats = {
+            'power': self.base_power + sum(bonus.power_bonus for bonus in equipped),
+            'defense': self.base_defense + sum(bonus.defense_bonus for bonus in equipped),
+            'max_hp': self.base_max_hp + sum(bonus.max_hp_bonus for bonus in equipped),
+            'speed': self.base_speed + sum(bonus.speed_bonus for bonus in equipped),
+            'regen': self.base_regen + sum(bonus.regen_bonus for bonus in equipped)
+        }
+        return self.stats
+
+    def regen(self, Game):
+        return (self.stats or self.update_stats(Game))['regen']
 
     def speed(self, Game):
-        bonus = sum(equipment.speed_bonus for equipment in get_all_equipped(self.owner, Game))
-        if self.buffs:
-            bonus += sum(buff.speed_bonus for buff in self.buffs)
-        return self.base_speed + bonus
+        return (self.stats or self.update_stats(Game))['speed']
 
     #@property
     def power(self, Game):
-        bonus = sum(equipment.power_bonus for equipment in get_all_equipped(self.owner, Game))
-        if self.buffs:
-            bonus += sum(buff.power_bonus for buff in self.buffs)
-        return self.base_power + bonus
+        return (self.stats or self.update_stats(Game))['power']
 
     #@property
     def defense(self, Game):
-        bonus = sum(equipment.defense_bonus for equipment in get_all_equipped(self.owner, Game))
-        if self.buffs:
-            bonus += sum(buff.defense_bonus for buff in self.buffs)
-        return self.base_defense + bonus
+        return (self.stats or self.update_stats(Game))['defense']
 
     #@property
     def max_hp(self, Game):
-        bonus = sum(equipment.max_hp_bonus for equipment in get_all_equipped(self.owner, Game))
-        if self.buffs:
-            bonus += sum(buff.max_hp_bonus for buff in self.buffs)
-        return self.base_max_hp + bonus
+        return (self.stats or self.update_stats(Game))['max_hp']
 
     def heal(self, amount, Game):
         #heal by the given amount
@@ -287,9 +391,9 @@ class Fighter(object):
             #make target take some damage
             if self is Game.player:
                 message('You attack ' + target.name  + '!', Game, libtcod.yellow)
-            elif entity_sees(Game.player, self.owner):
+            elif entity_sees(Game, Game.player, self.owner):
                 message(self.owner.name.capitalize() + ' attacks ' + target.name, Game, libtcod.yellow)
-            elif entity_sees(Game.player, target):
+            elif entity_sees(Game, Game.player, target):
                 message(target.name + ' has been attacked! ', Game, libtcod.yellow)
 
             target.fighter.take_damage(self.owner, damage, Game)
@@ -306,7 +410,9 @@ class Ai(object):
         return self.ai.take_turn(Game)
 
 
-class Buff(object):
+class Buff(Slotted):
+    __slots__ = ('name', 'power_bonus', 'defense_bonus', 'max_hp_bonus', 'speed_bonus', 'regen_bonus', 'decay_rate', 'duration', 'expires', 'owner')
+
     def __init__(self, name, power_bonus=0, defense_bonus=0, max_hp_bonus=0, speed_bonus=0, regen_bonus=0, decay_rate=data.BUFF_DECAYRATE, duration=data.BUFF_DURATION):
         self.name = name
         self.power_bonus = power_bonus
@@ -317,8 +423,11 @@ class Buff(object):
 
         self.decay_rate = decay_rate #if 0, buff does not decay. use positive numbers to make buffs decrement
         self.duration = duration
+        self.expires = None #tick the buff wears off. set by the scheduler
+
+class Caster(Slotted):
+    __slots__ = ('base_max_mp', 'mp', 'spells', 'owner')
 
-class Caster(object):
     def __init__(self, mp, spells=None):
         self.base_max_mp = mp
         self.mp = mp
@@ -336,7 +445,9 @@ class Caster(object):
     def forget_spell(self, spell):
         self.spells.remove(spell)
 
-class Spell(object):
+class Spell(Slotted):
+    __slots__ = ('name', 'use_function', 'owner')
+
     def __init__(self, name, use_function=None):
         self.name = name
         self.use_function = use_function
@@ -349,7 +460,9 @@ class Spell(object):
 
 #Items and Equipment
 
-class Item(object):
+class Item(Slotted):
+    __slots__ = ('use_function', 'owner')
+
     def __init__(self, use_function=None):
         self.use_function = use_function
 
@@ -384,6 +497,7 @@ class Item(object):
         else:
             user.fighter.add_item(self.owner)
             Game.objects[Game.dungeon_levelname].remove(self.owner)
+            Game.map[Game.dungeon_levelname].remove_object(self.owner)
             if user is Game.player:
                 name = 'You'
             else:
@@ -404,8 +518,7 @@ class Item(object):
         #add to the map and remove from the player's inventory. also, place it at the Game.player's coordinates
         Game.objects[Game.dungeon_levelname].append(self.owner)
         user.fighter.remove_item(self.owner)
-        self.owner.x = user.x
-        self.owner.y = user.y
+        Game.map[Game.dungeon_levelname].move_object(self.owner, user.x, user.y)
         self.owner.dungeon_level = data.maplist.index(Game.dungeon_levelname)
         self.owner.send_to_back(Game)
         if user is Game.player:
@@ -415,8 +528,10 @@ class Item(object):
         if self.owner.equipment:
             self.owner.equipment.dequip(Game, user)
 
-class Equipment(object):
+class Equipment(Slotted):
     #an object that can be equipped, yielding bonuses. automatically adds the Item component
+    __slots__ = ('slot', 'power_bonus', 'defense_bonus', 'max_hp_bonus', 'is_equipped', 'speed_bonus', 'regen_bonus', 'owner')
+
     def __init__(self, slot, power_bonus=0, defense_bonus=0, max_hp_bonus=0, speed_bonus=0, regen_bonus=0):
         self.slot = slot
         self.power_bonus = power_bonus
@@ -440,6 +555,8 @@ class Equipment(object):
 
         #equip object and show a message about it
         self.is_equipped = True
+        if user.fighter:
+            user.fighter.invalidate_stats()
         if isplayer(user, Game):
             name = 'You '
         else:
@@ -450,12 +567,68 @@ class Equipment(object):
         #dequip object and show a message about it
         if not self.is_equipped: return
         self.is_equipped = False        
+        if user.fighter:
+            user.fighter.invalidate_stats()
         if isplayer(user, Game):
             name = 'You '
         else:
             name = user.name
         message(name + ' unequipped ' + self.owner.name + ' from ' + self.slot + '.', Game, libtcod.light_green)  
 
+#Prototypes: entitydata entries compiled once, then copied for every spawn
+class Prototype(object):
+    #a finished object built from an entitydata entry. instantiate() copies it and its components,
+    #skipping Object.__init__ and the dict-to-component conversions
+    COMPONENTS = ('fighter', 'caster', 'item', 'equipment')
+
+    def __init__(self, entry):
+        self.template = Object(**entry)
+
+    def instantiate(self, **overrides):
+        obj = clone(self.template)
+        for name in self.COMPONENTS:
+            component = getattr(self.template, name)
+            if component:
+                component = clone(component)
+                component.owner = obj
+                setattr(obj, name, component)
+
+        for (attr, value) in overrides.items():
+            setattr(obj, attr, value)
+        return obj
+
+def clone(thing):
+    #shallow copy without calling __init__. templates only hold immutable values or None, so nothing gets shared
+    new = thing.__class__.__new__(thing.__class__)
+    if isinstance(thing, Slotted):
+        new.__setstate__(thing.__getstate__())
+    else:
+        new.__dict__.update(thing.__dict__) #components that aren't Slotted (yet)
+    return new
+
+#compiled prototypes keyed by (entitydata table, entry name). cleared when the data is reloaded
+prototypes = {}
+
+def get_prototype(table, name):
+    key = (id(table), name)
+    if key not in prototypes:
+        prototypes[key] = Prototype(table[name])
+    return prototypes[key]
+
+def clear_prototypes():
+    prototypes.clear()
+
+def spawn_many(prototype, positions, Game, **overrides):
+    #put a copy of prototype on every free (x, y) in positions on the current level. returns the objects placed
+    spawned = []
+    for (x, y) in positions:
+        if not is_blocked(x, y, Game):
+            obj = prototype.instantiate(dungeon_level=data.maplist.index(Game.dungeon_levelname), **overrides)
+            obj.set_location(x, y, Game)
+            Game.objects[Game.dungeon_levelname].append(obj)
+            spawned.append(obj)
+    return spawned
+
 #AI
 class ConfusedMonster(object):
     def __init__(self, old_ai, num_turns = data.CONFUSE_NUM_TURNS):
@@ -466,7 +639,7 @@ class ConfusedMonster(object):
     def take_turn(self, Game):
         if self.num_turns > 0: #still confused
             #move in random direction
-            self.owner.move(libtcod.random_get_int(0, -1, 1), libtcod.random_get_int(0, -1, 1), Game)
+            self.owner.move(Game.rng_ai.randint(-1, 1), Game.rng_ai.randint(-1, 1), Game)
             self.num_turns -= 1
             message(self.owner.name + ' is STILL confused!', Game, libtcod.red)
 
@@ -507,12 +680,12 @@ class BasicMonster(object):
             else:
                 fight = False
         if fight:
-            if libtcod.map_is_in_fov(monster.fighter.fov, nearest_nonclan.x, nearest_nonclan.y): #nearest_nonclan ensures same level
+            if libtcod.map_is_in_fov(monster.fighter.fov_map(Game), nearest_nonclan.x, nearest_nonclan.y): #nearest_nonclan ensures same level
                 #move or use item
                 #for now, use items or lose them
                 if monster.fighter.inventory:
                     #get random item from inv
-                    index = libtcod.random_get_int(0, 0, len(monster.fighter.inventory)-1)
+                    index = Game.rng_ai.randint(0, len(monster.fighter.inventory)-1)
                     item = monster.fighter.inventory[index].item
                     if not item.owner.equipment:
                         useditem = item.use(Game, user=monster)
@@ -544,8 +717,8 @@ class BasicMonster(object):
         else:
             return False
 
-def entity_sees(entity, target):
-    if libtcod.map_is_in_fov(entity.fighter.fov, target.x, target.y) and entity.dungeon_level == target.dungeon_level:
+def entity_sees(Game, entity, target):
+    if libtcod.map_is_in_fov(entity.fighter.fov_map(Game), target.x, target.y) and entity.dungeon_level == target.dungeon_level:
         return True
     else:
         return False
@@ -558,7 +731,7 @@ def use_red_crystal(Game, user):
         message('The ' + user.name + ' beomes ENRAGED!', Game, libtcod.red)
 
     buff_component = Buff('Super Strength', power_bonus=10)
-    user.fighter.add_buff(buff_component)
+    user.fighter.add_buff(buff_component, Game)
 
 def use_blue_crystal(Game, user):
     if user is Game.player:
@@ -567,7 +740,7 @@ def use_blue_crystal(Game, user):
         message('The ' + user.name + ' looks well protected!', Game, libtcod.red)
 
     buff_component = Buff('Super Defense', defense_bonus=10)
-    user.fighter.add_buff(buff_component)
+    user.fighter.add_buff(buff_component, Game)
 
 def use_green_crystal(Game, user):
     if user is Game.player:
@@ -576,7 +749,7 @@ def use_green_crystal(Game, user):
         message('The ' + user.name + ' feels more resilient!', Game, libtcod.red)
 
     buff_component = Buff('Super Health', max_hp_bonus=50)
-    user.fighter.add_buff(buff_component)
+    user.fighter.add_buff(buff_component, Game)
     user.fighter.hp = Game.player.fighter.max_hp(Game)
 
 def use_yellow_crystal(Game, user):
@@ -586,7 +759,7 @@ def use_yellow_crystal(Game, user):
         message('The ' + user.name + ' looks healthier!', Game, libtcod.red)
 
     buff_component = Buff('Super Regen', regen_bonus=-20)
-    user.fighter.add_buff(buff_component)
+    user.fighter.add_buff(buff_component, Game)
 
 def use_orange_crystal(Game, user):
     if user is Game.player:
@@ -595,7 +768,7 @@ def use_orange_crystal(Game, user):
         message('The ' + user.name + ' looks speedy!', Game, libtcod.orange)
 
     buff_component = Buff('Super Speed', speed_bonus=-3)
-    user.fighter.add_buff(buff_component)
+    user.fighter.add_buff(buff_component, Game)
 
 
 #spells
@@ -648,7 +821,7 @@ def cast_fireball(Game, user):
 
     #otherwise this is a mob
     elif target:
-        if libtcod.map_is_in_fov(user.fighter.fov, target.x, target.y) and target.dungeon_level == user.dungeon_level:
+        if libtcod.map_is_in_fov(user.fighter.fov_map(Game), target.x, target.y) and target.dungeon_level == user.dungeon_level:
             (x,y) = (target.x, target.y)
 
     if x is None or y is None:
@@ -659,11 +832,10 @@ def cast_fireball(Game, user):
         return data.STATE_CANCELLED
 
     else:
-        theDmg = roll_dice([[data.FIREBALL_DAMAGE/2, data.FIREBALL_DAMAGE*2]])[0]
+        theDmg = roll_dice([[data.FIREBALL_DAMAGE/2, data.FIREBALL_DAMAGE*2]], Game.rng_combat)[0]
         
         #create fireball fov based on x,y coords of target
-        fov_map_fireball = Game.map[Game.dungeon_levelname].fov_map
-        libtcod.map_compute_fov(fov_map_fireball, x, y, data.FIREBALL_RADIUS, data.FOV_LIGHT_WALLS, data.FOV_ALGO)
+        fov_map_fireball = Game.fov_cache.lookup(Game, Game.dungeon_levelname, x, y, data.FIREBALL_RADIUS)
 
         for obj in Game.objects[Game.dungeon_levelname]: #damage all fighters within range
             if libtcod.map_is_in_fov(fov_map_fireball, obj.x, obj.y) and obj.fighter:
@@ -739,7 +911,7 @@ def cast_lightning(Game, user):
 
     #otherwise, this is a mob
     elif target:
-        if not (libtcod.map_is_in_fov(user.fighter.fov, target.x, target.y) and target.dungeon_level == user.dungeon_level):
+        if not (libtcod.map_is_in_fov(user.fighter.fov_map(Game), target.x, target.y) and target.dungeon_level == user.dungeon_level):
             target = None
         #ensure monster is within player's fov
         
@@ -750,7 +922,7 @@ def cast_lightning(Game, user):
             message(user.name + ' cancels Lightning', Game, libtcod.red, False)
         return 'cancelled'
     else:
-        theDmg = roll_dice([[data.LIGHTNING_DAMAGE/2, data.LIGHTNING_DAMAGE]])[0]
+        theDmg = roll_dice([[data.LIGHTNING_DAMAGE/2, data.LIGHTNING_DAMAGE]], Game.rng_combat)[0]
 
         if user is Game.player:
             message('Your lightning bolt strikes the ' + target.name + '!  DMG = ' + str(theDmg) + ' HP.', Game, libtcod.light_blue)
@@ -767,12 +939,13 @@ def player_death(player, killer, Game):
     if killer:
         if killer.fighter:
             killer.fighter.xp += player.fighter.xpvalue
+            killer.fighter.kills += 1
             message(killer.name + ' killed you! New xp = ' + str(killer.fighter.xp)  + '(' + player.name + ')', Game, libtcod.red, isplayer(killer, Game))
 
     if not Game.player.fighter.killed:
         Game.player.char = '%'
         Game.player.color = libtcod.darkest_red
-        Game.player.blocks = False
+        Game.map[Game.dungeon_levelname].set_blocks(Game.player, False)
         Game.player.ai = None
         #Game.player.name = 'remains of ' + Game.player.name
         Game.player.always_visible = True
@@ -799,6 +972,7 @@ def monster_death(monster, killer, Game):
         
         if killer.fighter:
             killer.fighter.xp += monster.fighter.xpvalue
+            killer.fighter.kills += 1
 
         message(name + ' killed ' + monster.name + ' and gains ' + str(monster.fighter.xpvalue) + 'XP', Game, libtcod.orange, isplayer(killer, Game))
 
@@ -807,11 +981,12 @@ def monster_death(monster, killer, Game):
 
         monster.char = '%'
         monster.color = libtcod.darkest_red
-        monster.blocks = False
+        Game.map[Game.dungeon_levelname].set_blocks(monster, False)
         monster.ai = None
         #monster.name = 'remains of ' + monster.name
         monster.always_visible = True
         monster.fighter.alive = False
+        monster.fighter.death_tick = Game.tick
     
 
 
@@ -842,8 +1017,8 @@ def target_monster(Game, max_range = None):
             return None
 
         #return the first clicked monster, otherwise continue looping
-        for obj in Game.objects[Game.dungeon_levelname]:
-            if obj.x == x and obj.y == y and obj.fighter and obj != Game.player and obj.dungeon_level == Game.player.dungeon_level:
+        for obj in Game.map[Game.dungeon_levelname].objects_at(x, y):
+            if obj.fighter and obj != Game.player and obj.dungeon_level == Game.player.dungeon_level:
                 return obj
 
 def closest_monster(max_range, Game):
@@ -852,7 +1027,7 @@ def closest_monster(max_range, Game):
     closest_dist = max_range + 1 #start with slightly higher than max range
 
     for object in Game.objects[Game.dungeon_levelname]:
-        if object.fighter and not object == Game.player and libtcod.map_is_in_fov(Game.player.fighter.fov, object.x, object.y):
+        if object.fighter and not object == Game.player and libtcod.map_is_in_fov(Game.player.fighter.fov_map(Game), object.x, object.y):
             #calculate the distance between this and the player
             dist = Game.player.distance_to(object)
             if dist < closest_dist:
@@ -861,52 +1036,39 @@ def closest_monster(max_range, Game):
     return closest_enemy
 
 def fov_map(max_range, Game, dude):
-    #create fovmap for this dude
-    fov_map_dude = libtcod.map_new(data.MAP_WIDTH, data.MAP_HEIGHT)
-    for yy in range(data.MAP_HEIGHT):
-        for xx in range(data.MAP_WIDTH):
-            libtcod.map_set_properties(fov_map_dude, xx, yy, not Game.map[Game.dungeon_levelname].block_sight(xx, yy), not Game.map[Game.dungeon_levelname].blocked(xx, yy))
-
-    libtcod.map_compute_fov(fov_map_dude, dude.x, dude.y, max_range, data.FOV_LIGHT_WALLS, data.FOV_ALGO)
-    return fov_map_dude
+    #fovmap for this dude. only good until the next fov_cache lookup
+    return Game.fov_cache.lookup(Game, Game.dungeon_levelname, dude.x, dude.y, max_range)
 
 def closest_item(max_range, Game, dude):
-    #find closest nonclan entity up to max range in the object's FOV
-    closest_item = None
-    closest_dist = max_range + 1 #start with slightly higher than max range
-
-    if dude.fighter.fov is None:
-        fov_map_dude = Game.map[Game.dungeon_levelname].fov_map
-
-    fov_map_dude = dude.fighter.fov_recompute(Game)
-
-    for object in Game.objects[Game.dungeon_levelname]:
-        if object.item and libtcod.map_is_in_fov(fov_map_dude, object.x, object.y) and object.dungeon_level == dude.dungeon_level:
-            #calculate the distance between this and the dude
-            dist = dude.distance_to(object)
-            if dist < closest_dist:
-                closest_item = object
-                closest_dist = dist  
-    return closest_item
+    #find closest item up to max range in the object's FOV
+    return closest_object(max_range, Game, dude, lambda object: object.item)
 
 def closest_nonclan(max_range, Game, dude):
     #find closest nonclan entity up to max range in the object's FOV
-    closest_nonclan = None
-    closest_dist = max_range + 1 #start with slightly higher than max range
-
-    if dude.fighter.fov is None:
-        fov_map_dude = dude.fighter.set_fov(Game)
-
-    fov_map_dude = dude.fighter.fov_recompute(Game)
+    return closest_object(max_range, Game, dude, lambda object: object.fighter and object.fighter.clan != dude.fighter.clan and object.fighter.alive)
 
-    for object in Game.objects[Game.dungeon_levelname]:
-        if object.fighter and  object.fighter.clan != dude.fighter.clan and libtcod.map_is_in_fov(fov_map_dude, object.x, object.y) and object.dungeon_level == dude.dungeon_level and object.fighter.alive:
-            #calculate the distance between this and the dude
-            dist = dude.distance_to(object)
-            if dist < closest_dist:
-                closest_nonclan = object
-                closest_dist = dist           
-    return closest_nonclan
+def closest_object(max_range, Game, dude, wanted):
+    #closest object within max range that passes wanted() and is in the dude's FOV.
+    #walks the level's bucket rings outward from the dude and stops at the first ring that can't hold anything closer
+    #than the best in-fov object so far, so usually only the rings next to the dude are looked at
+    closest = None
+    closest_dist = max_range + 1 #start with slightly higher than max range
+    fov_map_dude = None #only computed once there's a candidate to check
+
+    for (min_dist, objects) in Game.map[Game.dungeon_levelname].bucket_rings(dude.x, dude.y, max_range):
+        if min_dist > closest_dist:
+            break
+        for object in objects:
+            if object.dungeon_level == dude.dungeon_level and wanted(object):
+                #calculate the distance between this and the dude
+                dist = dude.distance_to(object)
+                if dist < closest_dist:
+                    if fov_map_dude is None:
+                        fov_map_dude = dude.fighter.fov_recompute(Game)
+                    if libtcod.map_is_in_fov(fov_map_dude, object.x, object.y):
+                        closest = object
+                        closest_dist = dist
+    return closest
 
 
 def get_next_fighter(Game):
@@ -927,7 +1089,7 @@ def target_tile(Game, max_range = None):
         (x, y) = (Game.mouse.cx, Game.mouse.cy)
         (x, y) = (Game.camera_x + x, Game.camera_y + y) #from screen to map coords
 
-        if (Game.mouse.lbutton_pressed and libtcod.map_is_in_fov(Game.player.fighter.fov, x, y) and (max_range is None or Game.player.distance(x,y) <= max_range)):
+        if (Game.mouse.lbutton_pressed and libtcod.map_is_in_fov(Game.player.fighter.fov_map(Game), x, y) and (max_range is None or Game.player.distance(x,y) <= max_range)):
             return (x, y)
 
         if Game.mouse.rbutton_pressed or Game.key.vk == libtcod.KEY_ESCAPE:
@@ -939,11 +1101,7 @@ def is_blocked(x, y, Game):
         return True
 
     #now check for any blocking objects
-    for object in Game.objects[Game.dungeon_levelname]:
-        if object.blocks and object.x == x and object.y == y:
-            return True
-
-    return False
+    return Game.map[Game.dungeon_levelname].is_occupied(x, y)
 
 def total_alive_entities(Game):
     alive_entities = []
@@ -0,0 +1,90 @@
+#standard imports
+import libtcodpy as libtcod
+import data
+
+#specific imports needed for this module
+from collections import OrderedDict
+
+
+class FovHandle(object):
+    #an entity's own tcod map plus the key of the fov result it currently holds.
+    #fighter.fov points at handle.map, so nobody else's fov_recompute can overwrite it
+    def __init__(self, width=data.MAP_WIDTH, height=data.MAP_HEIGHT):
+        self.width = width
+        self.height = height
+        self.map = libtcod.map_new(width, height)
+        self.key = None   #(levelname, x, y, radius, algo, version) of the fov in self.map
+        self.level = None #(levelname, version) of the transparency data in self.map
+
+    def __getstate__(self):
+        #tcod maps don't survive pickling. a fresh one gets recomputed on first use
+        return {'width': self.width, 'height': self.height}
+
+    def __setstate__(self, state):
+        self.__init__(state['width'], state['height'])
+
+    def __del__(self):
+        if libtcod is not None and self.map:
+            libtcod.map_delete(self.map)
+            self.map = None
+
+
+class FovCache(object):
+    #LRU cache of computed fov results keyed by (level, x, y, radius, algo, map version).
+    #results are copied into the caller's handle, so evicting an entry never pulls a map out from under an entity
+    def __init__(self, size=data.FOV_CACHE_SIZE):
+        self.size = size
+        self.results = OrderedDict()
+        self.scratch = FovHandle() #for one-off lookups like fireballs
+        self.hits = 0
+        self.misses = 0
+
+    def compute(self, Game, handle, levelname, x, y, radius=data.TORCH_RADIUS, algo=data.FOV_ALGO):
+        #bring handle up to date with the fov seen from (x, y) and return its tcod map
+        level = Game.map[levelname]
+        key = (levelname, x, y, radius, algo, level.version)
+
+        if handle.key == key:
+            #hasn't moved and the map hasn't changed. reuse the last result
+            return handle.map
+
+        cached = self.results.pop(key, None)
+        if cached is not None:
+            self.hits += 1
+            self.results[key] = cached #most recently used goes to the end
+            libtcod.map_copy(cached, handle.map)
+        else:
+            self.misses += 1
+            if handle.level != (levelname, level.version):
+                #pick up the walls of the level the entity is on now
+                libtcod.map_copy(level.fov_map, handle.map)
+            libtcod.map_compute_fov(handle.map, x, y, radius, data.FOV_LIGHT_WALLS, algo)
+            self.store(key, handle.map)
+
+        handle.key = key
+        handle.level = (levelname, level.version)
+        return handle.map
+
+    def lookup(self, Game, levelname, x, y, radius=data.TORCH_RADIUS, algo=data.FOV_ALGO):
+        #fov from an arbitrary spot. the returned map is only good until the next lookup
+        return self.compute(Game, self.scratch, levelname, x, y, radius, algo)
+
+    def store(self, key, source):
+        if len(self.results) >= self.size:
+            #evict the least recently used entry and reuse its map
+            (oldkey, cached) = self.results.popitem(last=False)
+        else:
+            cached = libtcod.map_new(libtcod.map_get_width(source), libtcod.map_get_height(source))
+
+        libtcod.map_copy(source, cached)
+        self.results[key] = cached
+
+    def clear(self):
+        for cached in self.results.values():
+            libtcod.map_delete(cached)
+        self.results.clear()
+
+    def __del__(self):
+        #the scratch handle frees its own map
+        if libtcod is not None:
+            self.clear()
@@ -1,12 +1,29 @@
 #standard imports
 import libtcodpy as libtcod
 import data
+import tracing
 
 #specific imports needed for this module
 import math
-import textwrap
+import numpy
 
 #common class objects for shapes and tiles
+class Slotted(object):
+    #base for the classes there are thousands of (entities, components, messages). subclasses list their attributes
+    #in __slots__, so instances carry no __dict__. pickle needs to be told how to save and restore slots
+    __slots__ = ()
+
+    def slot_names(self):
+        return [name for cls in type(self).__mro__ for name in getattr(cls, '__slots__', ())]
+
+    def __getstate__(self):
+        #unset slots are left out, so hasattr() still works after a load
+        return dict((name, getattr(self, name)) for name in self.slot_names() if hasattr(self, name))
+
+    def __setstate__(self, state):
+        for (name, value) in state.items():
+            setattr(self, name, value)
+
 class Rect(object):
     #a rectangle on the map. used to characterize a room
     def __init__(self, x, y, w, h):
@@ -25,24 +42,92 @@ class Rect(object):
         return (self.x1 <= other.x2 and self.x2 >= other.x1 and
                 self.y1 <= other.y2 and self.y2 >= other.y1)
 
-class Tile(object):
-    #a tile of the map and its properties
-    def __init__(self, blocked, block_sight = None):
-        self.blocked = blocked
+class Menuobj(Slotted):
+    __slots__ = ('text', 'color', 'char')
 
-        #all tiles start out unexplored
-        self.explored = False
-
-        #by default, if a tile is blocked, it also blocks sight
-        if block_sight is None: block_sight = blocked
-        self.block_sight = block_sight
-
-class Menuobj(object):
     def __init__(self, text, color=None, char=None):
         self.text = text
         self.color = color
         self.char = char
 
+class Rng(object):
+    #seeded random number stream. numbers are drawn from numpy a block at a time and handed out from a buffer,
+    #instead of one ctypes call into libtcod per number. same seed, same sequence
+    def __init__(self, seed=None, block_size=data.RNG_BLOCK_SIZE):
+        self.state = numpy.random.RandomState(seed)
+        self.block_size = block_size
+        self.block = []
+        self.index = 0
+
+    def random(self):
+        #float in [0, 1)
+        if self.index >= len(self.block):
+            self.block = self.state.random_sample(self.block_size).tolist()
+            self.index = 0
+        self.index += 1
+        return self.block[self.index - 1]
+
+    def randint(self, low, high):
+        #int in [low, high], both ends included like libtcod.random_get_int
+        if high < low:
+            (low, high) = (high, low)
+        return low + int(self.random() * (high - low + 1))
+
+    def choice(self, seq):
+        return seq[int(self.random() * len(seq))]
+
+    def weighted_choice(self, chances):
+        #index into chances, picked with probability proportional to its weight
+        return random_choice_index(chances, self)
+
+    def split(self):
+        #independent child stream, seeded from this one
+        return Rng(self.randint(0, 0x7fffffff), self.block_size)
+
+class AliasTable(object):
+    #Walker's alias method: after an O(n) build, every weighted pick costs one random number, whatever the table size
+    def __init__(self, chances_dict):
+        self.keys = sorted(key for key in chances_dict if chances_dict[key] > 0)
+        weights = [chances_dict[key] for key in self.keys]
+        n = len(self.keys)
+        total = float(sum(weights))
+
+        #scale so the average column holds exactly 1. split into underfull and overfull columns, then
+        #top up each underfull column with the remainder of an overfull one
+        scaled = [weight * n / total for weight in weights]
+        self.prob = [1.0] * n
+        self.alias = range(n)
+        small = [i for i in range(n) if scaled[i] < 1.0]
+        large = [i for i in range(n) if scaled[i] >= 1.0]
+
+        while small and large:
+            (less, more) = (small.pop(), large.pop())
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            if scaled[more] < 1.0:
+                small.append(more)
+            else:
+                large.append(more)
+
+    def sample(self, rndgen=False):
+        #key chosen with probability proportional to its chance, or None if nothing has a chance
+        if not self.keys:
+            return None
+        if not rndgen:
+            rndgen = default_rng
+
+        #one draw picks the column (integer part) and the side of the split (fraction)
+        roll = rndgen.random() * len(self.keys)
+        column = int(roll)
+        if roll - column < self.prob[column]:
+            return self.keys[column]
+        return self.keys[self.alias[column]]
+
+
+#stream for callers that don't pass one. seeded from the clock
+default_rng = Rng()
+
 
 def mapname(Game):
     return(data.maplist[Game.player.dungeon_level])
@@ -50,24 +135,16 @@ def mapname(Game):
 #User Interface routines
 def message(new_msg, Game, color = libtcod.white, displaymsg=True):
     #split message if necessary
-    if data.PRINT_MESSAGES:
-        if data.FREE_FOR_ALL_MODE:
-            Game.message_sql.log_entity(Game, new_msg)
+    if data.FREE_FOR_ALL_MODE and Game.message_sql: #only there when sql logging is on
+        Game.message_sql.log_entity(Game, new_msg)
 
-        print 'MSG--\t ' + str(Game.tick) + '\t' + Game.dungeon_levelname + '\t' + new_msg
+    if data.PRINT_MESSAGES:
+        tracing.trace('MSG', tracing.INFO, Game.tick, Game.dungeon_levelname, new_msg)
 
     if displaymsg:
-        turn = Game.player.game_turns
-        new_msg_lines = textwrap.wrap(new_msg, data.MSG_WIDTH)
-
-        for line in new_msg_lines:
-            #if the buffer is full, remove the first line to make room for the new one
-            if len(Game.game_msgs) == data.MSG_HEIGHT:
-                del Game.game_msgs[0]
-
-            #add the new line as a tuple, with the txt and the color
-            Game.msg_history.append(Menuobj(str(turn) + ' : ' + line, color=color))
-            Game.game_msgs.append((line, color))
+        #both are bounded (see messagelog.py). the panel wraps lines when it draws them
+        Game.game_msgs.append(new_msg, color)
+        Game.msg_history.append(Game.player.game_turns, new_msg, color)
 
 
 
@@ -173,21 +250,40 @@ def inventory_menu(header, Game, user):
 
 
 #common gamestuff routines.  random number routines and distance calculators
+def new_rng_streams(Game, seed=None):
+    #one seed per game, split into independent streams for map generation, monster ai and combat.
+    #drawing more in one (say a monster wandering) doesn't shift what the others produce. no seed picks one
+    if seed is None:
+        seed = default_rng.randint(0, 0x7fffffff)
+    Game.seed = seed
+
+    master = Rng(seed)
+    Game.rng_mapgen = master.split()
+    Game.rng_ai = master.split()
+    Game.rng_combat = master.split()
+
+def level_rng(Game, levelnum):
+    #map generation stream for one level. levels get made on demand, in whatever order and across loads,
+    #so each one is seeded from the game seed and its number instead of sharing a stream
+    return Rng([Game.seed, levelnum])
+
 def flip_coin(rndgen=False):
     if not rndgen:
-        rndgen = 0
-    return (libtcod.random_get_int(rndgen,0,1))
+        rndgen = default_rng
+    return rndgen.randint(0, 1)
 
-def random_choice(chances_dict):
+def random_choice(chances_dict, rndgen=False):
     #choose one option from dict of chances and return key
     chances = chances_dict.values()
     strings = chances_dict.keys()
 
-    return strings[random_choice_index(chances)]
+    return strings[random_choice_index(chances, rndgen)]
 
-def random_choice_index(chances): #choose one option from list of chances. return index
+def random_choice_index(chances, rndgen=False): #choose one option from list of chances. return index
+    if not rndgen:
+        rndgen = default_rng
     #the dice will land on some number between 1 and sum of the chances
-    dice = libtcod.random_get_int(0, 1, sum(chances))
+    dice = rndgen.randint(1, sum(chances))
 
     #go through all chances, keeping the sum so far
     running_sum = 0
@@ -203,10 +299,12 @@ def random_choice_index(chances): #choose one option from list of chances. retur
 def get_distance(dx, dy):
     return math.sqrt(dx ** 2 + dy ** 2)
 
-def roll_dice(dicelist):
+def roll_dice(dicelist, rndgen=False):
+    if not rndgen:
+        rndgen = default_rng
     dice=[]
     for [die_low, die_high] in dicelist:
-        roll = libtcod.random_get_int(0,die_low,die_high)
+        roll = rndgen.randint(die_low, die_high)
         dice.append(roll)
 
     return [sum(dice), dice]
@@ -219,46 +317,7 @@ def render_all(Game):
     if Game.fov_recompute:
         #recompute FOV if needed (if player moved or something else happened)
         Game.fov_recompute = False
-        Game.player.fighter.fov_recompute(Game)
-        libtcod.console_clear(Game.con)
-
-        for y in range(data.CAMERA_HEIGHT):
-            for x in range(data.CAMERA_WIDTH):
-                (map_x, map_y) = (Game.camera_x + x, Game.camera_y + y)
-                visible = libtcod.map_is_in_fov(Game.player.fighter.fov, map_x, map_y)
-                wall = Game.map[Game.dungeon_levelname].block_sight(map_x, map_y)
-
-                if data.ASCIIMODE:
-                    thewallchar  = data.WALL_CHAR
-                    thegroundchar = data.GROUND_CHAR
-                else:
-                    thewallchar  = data.TILE_WALL
-                    thegroundchar = data.TILE_GROUND
-
-                #thegroundchar = data.GROUND_CHAR
-                if not visible:
-                    #tile not visible
-                    if wall:
-                        color_wall_ground = data.COLOR_DARK_WALL
-                        char_wall_ground = thewallchar
-                    else:
-                        color_wall_ground = data.COLOR_DARK_GROUND
-                        char_wall_ground = thegroundchar
-                    fov_wall_ground = libtcod.grey
-                else:
-                    #tile is visible
-                    Game.map[Game.dungeon_levelname].set_explored(map_x, map_y)
-                    if wall:
-                        color_wall_ground = data.COLOR_LIGHT_WALL
-                        char_wall_ground = thewallchar
-                    else:
-                        color_wall_ground = data.COLOR_LIGHT_GROUND
-                        char_wall_ground = thegroundchar
-                    fov_wall_ground = libtcod.white
-
-                if Game.map[Game.dungeon_levelname].explored(map_x, map_y):
-                    libtcod.console_put_char_ex(Game.con, x, y, char_wall_ground, fov_wall_ground, color_wall_ground)
-                
+        render_map(Game)
 
     #draw all objects in the list
     for object in Game.objects[Game.dungeon_levelname]:
@@ -270,7 +329,77 @@ def render_all(Game):
     #blit contents of con to root console
     libtcod.console_blit(Game.con, 0, 0, data.SCREEN_WIDTH, data.SCREEN_HEIGHT, 0, 0, 0)
 
-    #show player's stats via GUI panel
+    #show player's stats via GUI panel. only redraw it when something on it changed
+    names = get_names_under_mouse(Game)
+    panel_key = (Game.player.fighter.hp, Game.player.fighter.max_hp(Game), Game.dungeon_levelname, Game.player.dungeon_level,
+        Game.player.game_turns, Game.tick, Game.msg_history.total, names)
+
+    if panel_key != Game.panel_key:
+        Game.panel_key = panel_key
+        render_panel(Game, names)
+
+    #blit panel to root console
+    libtcod.console_blit(Game.panel, 0, 0, data.SCREEN_WIDTH, data.PANEL_HEIGHT, 0, 0, data.PANEL_Y)
+
+def render_map(Game):
+    #build the camera view as arrays and push it to the console with three fill calls.
+    #skipped entirely unless the camera, the player's fov or the explored set changed
+    level = Game.map[Game.dungeon_levelname]
+    fov = Game.player.fighter.fov_recompute(Game)
+
+    key = (Game.dungeon_levelname, Game.camera_x, Game.camera_y, Game.player.fighter.fov_handle.key, level.version, level.explored_version)
+    if key == Game.map_layer_key:
+        return
+    Game.map_layer_key = key
+
+    (x0, y0, w, h) = (Game.camera_x, Game.camera_y, data.CAMERA_WIDTH, data.CAMERA_HEIGHT)
+    visible = level.visible_in(fov, x0, y0, w, h)
+    level.explored_map[x0:x0 + w, y0:y0 + h] |= visible
+
+    #work in [y, x] from here on, which is the order the console wants
+    visible = visible.T[..., numpy.newaxis]
+    wall = ~level.transparent_map[x0:x0 + w, y0:y0 + h].T
+    explored = level.explored_map[x0:x0 + w, y0:y0 + h].T
+
+    if data.ASCIIMODE:
+        (thewallchar, thegroundchar) = (ord(data.WALL_CHAR), ord(data.GROUND_CHAR))
+    else:
+        (thewallchar, thegroundchar) = (data.TILE_WALL, data.TILE_GROUND)
+
+    tile_wall = wall[..., numpy.newaxis]
+    color_light = numpy.where(tile_wall, rgb(data.COLOR_LIGHT_WALL), rgb(data.COLOR_LIGHT_GROUND))
+    color_dark = numpy.where(tile_wall, rgb(data.COLOR_DARK_WALL), rgb(data.COLOR_DARK_GROUND))
+
+    #unexplored tiles look like a cleared console: blank, white on black
+    (con_w, con_h) = (libtcod.console_get_width(Game.con), libtcod.console_get_height(Game.con))
+    chars = numpy.empty((con_h, con_w), dtype=numpy.int32)
+    chars.fill(ord(' '))
+    fore = numpy.empty((con_h, con_w, 3), dtype=numpy.int32)
+    fore[:] = rgb(libtcod.white)
+    back = numpy.zeros((con_h, con_w, 3), dtype=numpy.int32)
+
+    chars[:h, :w] = numpy.where(explored, numpy.where(wall, thewallchar, thegroundchar), ord(' '))
+    explored = explored[..., numpy.newaxis]
+    fore[:h, :w] = numpy.where(explored, numpy.where(visible, rgb(libtcod.white), rgb(libtcod.grey)), rgb(libtcod.white))
+    back[:h, :w] = numpy.where(explored, numpy.where(visible, color_light, color_dark), 0)
+
+    libtcod.console_fill_char(Game.con, chars.ravel())
+    libtcod.console_fill_foreground(Game.con, fore[..., 0].ravel(), fore[..., 1].ravel(), fore[..., 2].ravel())
+    libtcod.console_fill_background(Game.con, back[..., 0].ravel(), back[..., 1].ravel(), back[..., 2].ravel())
+
+    #kept so objects can put back the tile they were standing on
+    Game.map_layer = (chars, fore, back)
+
+def restore_map_cell(Game, x, y):
+    #redraw the map tile at camera coords (x, y) from the last render_map
+    if Game.map_layer is not None:
+        (chars, fore, back) = Game.map_layer
+        libtcod.console_put_char_ex(Game.con, x, y, int(chars[y, x]), libtcod.Color(*fore[y, x].tolist()), libtcod.Color(*back[y, x].tolist()))
+
+def rgb(color):
+    return (color.r, color.g, color.b)
+
+def render_panel(Game, names):
     libtcod.console_set_default_background(Game.panel, libtcod.black)
     libtcod.console_clear(Game.panel)
 
@@ -282,17 +411,14 @@ def render_all(Game):
 
     #print the game messages, one line at a time
     y = 1
-    for (line, color) in Game.game_msgs:
+    for (line, color) in Game.game_msgs.lines():
         libtcod.console_set_default_foreground(Game.panel, color)
         libtcod.console_print_ex(Game.panel, data.MSG_X, y, libtcod.BKGND_NONE, libtcod.LEFT, line)
         y += 1
 
     #display names of objects under the mouse
     libtcod.console_set_default_foreground(Game.panel, libtcod.light_gray)
-    libtcod.console_print_ex(Game.panel, 1, 0, libtcod.BKGND_NONE, libtcod.LEFT, get_names_under_mouse(Game))
-
-    #blit panel to root console
-    libtcod.console_blit(Game.panel, 0, 0, data.SCREEN_WIDTH, data.PANEL_HEIGHT, 0, 0, data.PANEL_Y)
+    libtcod.console_print_ex(Game.panel, 1, 0, libtcod.BKGND_NONE, libtcod.LEFT, names)
 
 def render_bar(x, y, total_width, name, value, maximum, bar_color, back_color, Game):
     #render a bar (HP, exp, etc). first calc the width of the bar
@@ -320,8 +446,8 @@ def get_names_under_mouse(Game):
     (x, y) = (Game.camera_x + x, Game.camera_y + y)  #from screen to map coords
 
     #create list with the names of all objects at the mouse's coords and in FOV
-    names = [obj.name for obj in Game.objects[Game.dungeon_levelname]
-        if obj.x == x and obj.y == y and libtcod.map_is_in_fov(Game.player.fighter.fov, obj.x, obj.y)]
+    names = [obj.name for obj in Game.map[Game.dungeon_levelname].objects_at(x, y)
+        if libtcod.map_is_in_fov(Game.player.fighter.fov_map(Game), obj.x, obj.y)]
     
     names = ', '.join(names) #join names separated by commas
     return names.capitalize()
@@ -337,8 +463,8 @@ def player_move_or_attack(dx, dy, Game):
     #try to find attackable object there
     target = None
     #only check objects on the same floor as the player
-    for object in Game.objects[data.maplist[Game.player.dungeon_level]]:
-        if object.x == x and object.y == y and object.fighter:
+    for object in Game.map[data.maplist[Game.player.dungeon_level]].objects_at(x, y):
+        if object.fighter:
             target = object
             break
 
@@ -352,8 +478,8 @@ def player_move_or_attack(dx, dy, Game):
             Game.player.game_turns +=1
             state = data.STATE_PLAYING
 
-            for object in Game.objects[data.maplist[Game.player.dungeon_level]]: #look for items in the player's title
-                if object.x == Game.player.x and object.y == Game.player.y and object is not Game.player:
+            for object in Game.map[data.maplist[Game.player.dungeon_level]].objects_at(Game.player.x, Game.player.y): #look for items in the player's title
+                if object is not Game.player:
                     message('* You see ' + object.name + ' at your feet *', Game, libtcod.yellow)
 
         else:
@@ -0,0 +1,138 @@
+#standard imports
+import data
+
+#specific imports needed for this module
+import os
+import time
+import savegame
+import scheduler
+import tracing
+
+
+class LevelCache(object):
+    #decides which levels are simulated and which are in memory at all. the player's level and the ones within
+    #data.LEVEL_LIVE_DISTANCE of it run as normal. further away a level is frozen: its events come out of the
+    #scheduler and nothing on it moves. a level frozen for data.LEVEL_EVICT_MINUTES, or data.LEVEL_EVICT_DISTANCE
+    #or more levels away, is packed into a spill file and dropped from Game.map/Game.objects until the player comes back
+    def __init__(self, path=data.LEVEL_SPILL_PATH):
+        self.path = path
+        self.frozen_since = {} #levelname -> wall clock time it was frozen at. for the timed eviction
+        self.evicted = {}      #levelname -> tick it was evicted (or loaded) at
+
+    def update(self, Game):
+        #call whenever the player changes level (and after a load). thaws what came into range, freezes and evicts the rest
+        for (index, levelname) in enumerate(data.maplist):
+            if index == 0: #skip intro level
+                continue
+            distance = abs(index - Game.player.dungeon_level)
+
+            if levelname in self.evicted:
+                if distance <= data.LEVEL_LIVE_DISTANCE:
+                    self.restore(Game, levelname)
+                    self.thaw(Game, levelname)
+            elif levelname in Game.map:
+                if distance <= data.LEVEL_LIVE_DISTANCE:
+                    if Game.map[levelname].frozen_at is not None:
+                        self.thaw(Game, levelname)
+                    continue
+
+                if Game.map[levelname].frozen_at is None:
+                    self.freeze(Game, levelname)
+                elif levelname not in self.frozen_since:
+                    self.frozen_since[levelname] = time.time() #came out of a save already frozen
+                if distance >= data.LEVEL_EVICT_DISTANCE:
+                    self.evict(Game, levelname)
+
+    def tick(self, Game):
+        #call between ticks. evicts levels that have sat frozen for long enough
+        if not self.frozen_since:
+            return
+        now = time.time()
+        for (levelname, since) in self.frozen_since.items():
+            if now - since >= data.LEVEL_EVICT_MINUTES * 60:
+                self.evict(Game, levelname)
+
+    def freeze(self, Game, levelname):
+        #take every event on the level out of the scheduler. the fighters keep their next_turn/next_regen/expires,
+        #which is all thaw needs to pick them up again
+        Game.map[levelname].frozen_at = Game.tick
+        self.frozen_since[levelname] = time.time()
+
+        members = set(Game.objects[levelname])
+        members.discard(Game.player)
+        Game.scheduler.drop(lambda object: object in members)
+        tracing.trace('MAPGEN', tracing.INFO, Game.tick, levelname, 'froze level')
+
+    def thaw(self, Game, levelname):
+        #fast forward the level over the ticks it was frozen for, then put it back in the scheduler
+        level = Game.map[levelname]
+        elapsed = Game.tick - level.frozen_at
+        for object in Game.objects[levelname]:
+            if object is not Game.player and object.fighter and object.fighter.alive:
+                fast_forward(Game, object, elapsed)
+
+        level.frozen_at = None
+        self.frozen_since.pop(levelname, None)
+        scheduler.schedule_level(Game, levelname)
+        tracing.trace('MAPGEN', tracing.INFO, Game.tick, levelname, 'thawed level after %d ticks', elapsed)
+
+    def evict(self, Game, levelname):
+        #same bytes as the level's save record, so a save can copy the spill file as it is
+        if Game.map[levelname].frozen_at is None:
+            self.freeze(Game, levelname)
+        if Game.fighter_store is not None:
+            for object in Game.objects[levelname]:
+                if object is not Game.player and object.fighter and object.fighter.store is Game.fighter_store:
+                    Game.fighter_store.detach(object.fighter)
+
+        self.spill(Game, levelname, savegame.record_bytes(savegame.level_record(Game, levelname)))
+        Game.map[levelname].release() #its fov map and flow fields. restore builds new ones
+        del Game.map[levelname]
+        del Game.objects[levelname]
+        Game.upstairs.pop(levelname, None)
+        Game.downstairs.pop(levelname, None)
+        self.frozen_since.pop(levelname, None)
+        tracing.trace('MAPGEN', tracing.INFO, Game.tick, levelname, 'evicted level')
+
+    def spill(self, Game, levelname, blob):
+        #the spill files are a cache, not a save. no fsync, but still renamed into place so nothing ever reads half of one
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        savegame.write_file(self.filename(levelname), blob, sync=False)
+        self.evicted[levelname] = Game.tick
+
+    def restore(self, Game, levelname):
+        savegame.unpack_level(Game, savegame.read_file(self.path, levelname))
+        level = Game.map[levelname]
+        if level.frozen_at is None:
+            level.frozen_at = self.evicted[levelname] #was live when saved. it has been frozen since the load
+        del self.evicted[levelname]
+
+        Game.objects[levelname].insert(0, Game.player) #the player sits in every level's object list
+        level.initialize_fov()
+
+    def filename(self, levelname):
+        return os.path.join(self.path, levelname)
+
+    def record(self, levelname):
+        #save record of an evicted level. the spill file holds exactly those bytes
+        return savegame.read_file(self.path, levelname)
+
+
+def fast_forward(Game, object, elapsed):
+    #what elapsed ticks do to a fighter nobody was simulating: regen keeps ticking and buffs run out, but no turns
+    #are taken. turns shift by elapsed so the level wakes up with the same stagger it went to sleep with
+    fighter = object.fighter
+    fighter.next_turn += elapsed
+
+    if fighter.next_regen is not None and fighter.next_regen <= Game.tick:
+        period = max(1, fighter.regen(Game))
+        steps = 1 + (Game.tick - fighter.next_regen) / period
+        fighter.hp = min(fighter.hp + steps * int(fighter.max_hp(Game) * data.REGEN_MULTIPLIER), fighter.max_hp(Game))
+        fighter.next_regen += steps * period
+
+    if fighter.buffs:
+        for buff in list(fighter.buffs):
+            if buff.expires is not None and buff.expires < Game.tick:
+                buff.duration = 0
+                fighter.remove_buff(buff)
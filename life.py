@@ -3,8 +3,13 @@ from gamestuff import *
 import data
 import entitydata
 import time
+import numpy
 
 class World(object):
+    #population[xx, yy] is the age of the cell: 0 is dead, otherwise how many generations it has been alive.
+    #the whole board is updated with array ops, so big boards stay interactive
+    TABLE_SIZE = 128 #ages past this all look the same
+
     def __init__(self, nwidth, nheight, alivechar, deadchar,char_option, rndgen):
         
         self.nwidth = nwidth
@@ -12,39 +17,40 @@ class World(object):
         self.alive = alivechar
         self.dead = deadchar
         self.char_option = char_option
-        self.population =[]
+        self.population = None
         self.generation = 0
         self.rndgen = rndgen
 
         self.con = libtcod.console_new(self.nwidth,self.nheight)
 
+        #char and color for each age, so get_world can look the whole board up at once
+        self.char_table = numpy.array([ord(self.get_entity(age, self.char_option)) for age in range(self.TABLE_SIZE)], dtype=numpy.int32)
+        colors = [self.get_color(age) for age in range(self.TABLE_SIZE)]
+        self.color_table = numpy.array([(color.r, color.g, color.b) for color in colors], dtype=numpy.int32)
+
         self.init_world()
 
     def init_world(self):
         self.generation = 0
-        self.population = [[ flip_coin(self.rndgen)
-        for yy in range(self.nheight) ]
-            for xx in range(self.nwidth) ]
+        #one draw from rndgen seeds the whole board, so the same rndgen still gives the same worlds
+        seed = libtcod.random_get_int(self.rndgen, 0, 0x7fffffff)
+        self.population = numpy.random.RandomState(seed).randint(0, 2, size=(self.nwidth, self.nheight)).astype(numpy.int32)
 
     def check_stable(self):
         MAX_POP = 125
-        num_unstable=0
-        for yy in range(self.nheight):
-            for xx in range(self.nwidth):
-                if self.population[xx][yy] > 2 and self.population[xx][yy] <=MAX_POP:
-                    num_unstable+=1
+        num_unstable = numpy.count_nonzero((self.population > 2) & (self.population <= MAX_POP))
 
         if num_unstable < 5 and self.generation >500:
             self.init_world()    
 
     def get_world(self):
+        #console wants row major, population is [xx, yy]
+        ages = numpy.minimum(self.population, self.TABLE_SIZE - 1).T.ravel()
+        colors = self.color_table[ages]
+
         libtcod.console_clear(self.con)
-        for yy in range(self.nheight):        
-            for xx in range(self.nwidth):
-                #my_color=self.random_color() 
-                my_color = self.get_color(self.population[xx][yy])
-                libtcod.console_set_default_foreground(self.con, my_color)
-                libtcod.console_print_ex(self.con, xx, yy, libtcod.BKGND_NONE, libtcod.LEFT, self.get_entity(self.population[xx][yy], self.char_option))
+        libtcod.console_fill_char(self.con, self.char_table[ages])
+        libtcod.console_fill_foreground(self.con, colors[:, 0], colors[:, 1], colors[:, 2])
         return self.con
 
     def get_entity(self, entity, option):
@@ -91,39 +97,17 @@ class World(object):
 
     def update(self):
         self.generation+=1
-        new_population = []
-        new_population = [[ 0
-            for yy in range(self.nheight) ]
-                for xx in range(self.nwidth) ]
-
-        for yy in range(self.nheight):        
-            for xx in range(self.nwidth):    
-
-                if self.isalive(self.population[xx][yy]):
-                    state = self.alive
-                else:
-                    state = self.dead
-
-                num_neighbors = self.neighbors(xx,yy)
-                #print str(xx) + '/' + str(yy) + ':' + str(state) + '\t' + str(num_neighbors)
-                if state == self.alive:
-                    #check rules 1 & 3 (rule 2, nothing happens)
-                    if num_neighbors <2 or num_neighbors >3:
-                        #rule 1: #neighbors < 2, alive->dead
-                        #rule 3: #neighbors = 4, alive->dead
-                        new_population[xx][yy] = 0
-                        #print '!!! DEATH !!!'
-                    else:
-                        new_population[xx][yy] = self.population[xx][yy]+1
-                        #print 'STAYIN ALIVE!'
-                else: #dead
-                    #check rule 4
-                    if num_neighbors == 3:
-                        #rule 4: #neighbors = 3 alive, dead->alive
-                        new_population[xx][yy] = self.population[xx][yy]+1
-                        #print '??? BACK FROM DEATH ???'
-
-        self.population = new_population
+        alive = self.population > 0
+        num_neighbors = self.neighbors(alive)
+
+        #rule 1: #neighbors < 2, alive->dead
+        #rule 2: #neighbors = 2 or 3, alive stays alive and gets older
+        #rule 3: #neighbors > 3, alive->dead
+        #rule 4: #neighbors = 3, dead->alive
+        survives = alive & ((num_neighbors == 2) | (num_neighbors == 3))
+        born = ~alive & (num_neighbors == 3)
+
+        self.population = numpy.where(survives | born, self.population + 1, 0).astype(numpy.int32)
             
     def get_color(self, code):
         rr = 8
@@ -143,47 +127,16 @@ class World(object):
         bb = libtcod.random_get_int(0,0,255)
         return libtcod.Color(rr,gg,bb)
 
-    def isalive(self,entity):
-        if entity > 0:
-            return True
-        else:
-            return False
-
-    def neighbors(self, xx,yy):
-        num_neighbors=0
-
-        if xx != 0: #not far left
-            if self.isalive(self.population[xx-1][yy]):
-                num_neighbors+=1
-
-        if xx !=self.nwidth-1: #not far right
-            if self.isalive(self.population[xx+1][yy]):
-                num_neighbors+=1            
-
-        if yy != 0: #not far bottom
-            if self.isalive(self.population[xx][yy-1]):
-                num_neighbors+=1
-
-        if yy != self.nheight-1: #not far top
-            if self.isalive(self.population[xx][yy+1]):
-                num_neighbors+=1
-
-        if xx != 0 and yy != 0: #not bottom left
-            if self.isalive(self.population[xx-1][yy-1]):
-                num_neighbors+=1
-
-        if xx != 0 and yy != self.nheight-1: #not top left
-            if self.isalive(self.population[xx-1][yy+1]):
-                num_neighbors+=1
-
-        if xx != nwidth-1 and yy != 0: #not bottom right
-            if self.isalive(self.population[xx+1][yy-1]):
-                num_neighbors+=1
-
-        if xx != nwidth-1 and yy != nheight-1: #not top right
-            if self.isalive(self.population[xx+1][yy+1]):
-                num_neighbors+=1
+    def neighbors(self, alive):
+        #live neighbor count for every cell. the edges don't wrap, so pad the board with a ring of dead cells
+        padded = numpy.zeros((self.nwidth + 2, self.nheight + 2), dtype=numpy.uint8)
+        padded[1:-1, 1:-1] = alive
 
+        num_neighbors = numpy.zeros((self.nwidth, self.nheight), dtype=numpy.uint8)
+        for dx in (0, 1, 2):
+            for dy in (0, 1, 2):
+                if dx != 1 or dy != 1:
+                    num_neighbors += padded[dx:dx + self.nwidth, dy:dy + self.nheight]
         return num_neighbors
 
 
@@ -2,6 +2,19 @@ import sqlite3 as sql
 import data
 from subprocess import Popen
 
+#specific imports needed for this module
+import threading
+import Queue
+import tracing
+
+
+#column order of the row tuples buffered by Sqlobj.log_entity
+COLUMNS = {
+    data.ENTITY_DB: ('game_id', 'entity_id', 'name', 'tick', 'hp', 'hp_max', 'power', 'power_base', 'defense', 'defense_base',
+        'xp', 'xp_level', 'speed_counter', 'regen_counter', 'alive_or_dead', 'dungeon_level', 'dungeon_levelname', 'x', 'y'),
+    data.MESSAGE_DB: ('game_id', 'msg_id', 'name', 'tick', 'dungeon_levelname')
+}
+
 
 class Sqlobj(object):
     def __init__(self, dbtype):
@@ -50,81 +63,149 @@ class Sqlobj(object):
             """
         
         self.DB_FILE = self.dbtype  + '.db'
-        self.conn = sql.connect(self.DB_FILE)
-        self.cursor = self.conn.cursor()
-        self.cursor.executescript(script)
-        self.game_id = self.cursor.execute("SELECT IFNULL(MAX(game_id), 0) + 1 FROM " + self.dbtype).fetchone()[0]
+        conn = sql.connect(self.DB_FILE)
+        #WAL sticks to the database file. synchronous is per connection and gets set again by the writer
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(script)
+        self.game_id = conn.execute("SELECT IFNULL(MAX(game_id), 0) + 1 FROM " + self.dbtype).fetchone()[0]
+        conn.close()
+
+        #prepared once, reused for every batch
+        self.rows = []
+        self.insert = "INSERT INTO " + self.dbtype + "(" + ", ".join(COLUMNS[self.dbtype]) + ") VALUES (" + ", ".join("?" * len(COLUMNS[self.dbtype])) + ")"
+        self.writer = SqlWriter(self.DB_FILE, self.insert)
 
     def log_entity(self, Game, thing):
+        #rows are buffered as tuples in COLUMNS order and written in one go by log_flush
 
         if self.dbtype == data.ENTITY_DB:
             entity = thing
             if not hasattr(thing, 'entity_id'):
                 self.index_counter += 1
                 entity.entity_id = self.index_counter
-            
-        if self.dbtype == data.MESSAGE_DB:
+
+            self.rows.append((
+                self.game_id,
+                entity.entity_id,
+                entity.name,
+                Game.tick,
+                entity.fighter.hp,
+                entity.fighter.max_hp(Game),
+                entity.fighter.power(Game),
+                entity.fighter.base_power,
+                entity.fighter.defense(Game),
+                entity.fighter.base_defense,
+                entity.fighter.xp,
+                entity.fighter.xplevel,
+                entity.fighter.next_turn - Game.tick,
+                entity.fighter.next_regen - Game.tick,
+                int(entity.fighter.alive),
+                entity.dungeon_level,
+                data.maplist[entity.dungeon_level],
+                entity.x,
+                entity.y))
+
+        elif self.dbtype == data.MESSAGE_DB:
             message = thing
-            entity = thing
-            if not hasattr(thing, 'msg_id'):
-                self.index_counter += 1
-                msg_id = self.index_counter
-
-        if self.dbtype == data.ENTITY_DB:            
-            the_data = {
-                "game_id": self.game_id,
-                "entity_id": entity.entity_id,
-                "name": entity.name,
-                "tick": Game.tick,
-                "hp": entity.fighter.hp,
-                "hp_max": entity.fighter.max_hp(Game),
-                "power": entity.fighter.power(Game),
-                "power_base": entity.fighter.base_power,
-                "defense": entity.fighter.defense(Game),
-                "defense_base": entity.fighter.base_defense,
-                "xp": entity.fighter.xp,
-                "xp_level": entity.fighter.xplevel,
-                "speed_counter": entity.fighter.speed_counter,
-                "regen_counter": entity.fighter.regen_counter,
-                "alive_or_dead": int(entity.fighter.alive),
-                "dungeon_level": entity.dungeon_level,
-                "dungeon_levelname": data.maplist[entity.dungeon_level],
-                "x": entity.x,
-                "y": entity.y
-            }
-
-        elif self.dbtype == data.MESSAGE_DB:            
-            the_data = {
-                "game_id": self.game_id,
-                "msg_id": msg_id,
-                "name": message,
-                "tick": Game.tick,
-                "dungeon_levelname": Game.dungeon_levelname
-            }
-
-        dict_insert(self.cursor, self.dbtype, the_data)
+            self.index_counter += 1
+
+            self.rows.append((
+                self.game_id,
+                self.index_counter,
+                message,
+                Game.tick,
+                Game.dungeon_levelname))
 
     def log_event(self):
         pass
 
     def log_flush(self, Game, force_flush=False):
+        #hand one batch per SQL_COMMIT_TICK_COUNT ticks to the writer thread (one executemany and one commit there).
+        #the caller resets Game.sql_commit_counter once every Sqlobj has had its chance to flush
         if Game.sql_commit_counter <= 0 or force_flush:
-            self.conn.commit()
-            if Game.sql_commit_counter <= 0:
-                Game.sql_commit_counter = data.SQL_COMMIT_TICK_COUNT
+            if self.rows:
+                self.writer.put(self.rows)
+                self.rows = []
+
+    def close(self):
+        #write whatever is still buffered and wait for the writer to finish. call before export_csv
+        if self.rows:
+            self.writer.put(self.rows)
+            self.rows = []
+        self.writer.close()
 
     def export_csv(self):
         p = Popen("export_sql2csv.bat " + self.dbtype + ' ' + self.DB_FILE )
         p.communicate()
 
-# this is silly, should be builtin
-def dict_insert(cursor, table, data):
-    query = "INSERT INTO " + table + "(" + ", ".join(data.keys()) + ") VALUES (:" + ", :".join(data.keys()) + ")"
-    try:
-        return cursor.execute(query, data)
-    except:
-        print "Query failure! Query was:", query
-        return None
 
+class SqlWriter(object):
+    #drains batches of rows from a bounded queue into the database on its own thread and connection,
+    #so disk stalls don't hold up the tick loop. what happens when the queue is full depends on data.SQL_QUEUE_POLICY:
+    #   'block'       - wait for the writer to catch up. nothing is lost
+    #   'drop-oldest' - throw away the oldest queued batch to make room
+    #   'sample'      - keep only every SQL_QUEUE_SAMPLE'th row of the new batch, and drop that too if there's still no room
+    def __init__(self, db_file, insert, maxsize=data.SQL_QUEUE_SIZE, policy=data.SQL_QUEUE_POLICY):
+        self.db_file = db_file
+        self.insert = insert
+        self.policy = policy
+        self.queue = Queue.Queue(maxsize)
+        self.dropped = 0 #rows lost to backpressure
+        self.closed = False
+
+        self.thread = threading.Thread(target=self.run, name='sql writer ' + db_file)
+        self.thread.daemon = True #don't hang the game on exit if nobody called close
+        self.thread.start()
+
+    def put(self, rows):
+        if self.closed:
+            self.dropped += len(rows)
+            return
+
+        if self.policy == 'drop-oldest':
+            while True:
+                try:
+                    self.queue.put_nowait(rows)
+                    return
+                except Queue.Full:
+                    try:
+                        self.dropped += len(self.queue.get_nowait())
+                    except Queue.Empty:
+                        pass
+
+        elif self.policy == 'sample' and self.queue.full():
+            kept = rows[::data.SQL_QUEUE_SAMPLE]
+            self.dropped += len(rows) - len(kept)
+            try:
+                self.queue.put_nowait(kept)
+            except Queue.Full:
+                self.dropped += len(kept) #writer still behind. never wait on it
+            return
+
+        self.queue.put(rows)
+
+    def close(self):
+        #queue the stop marker behind everything else and wait till it's all on disk
+        if not self.closed:
+            self.closed = True
+            self.queue.put(None)
+            self.thread.join()
+            if self.dropped:
+                tracing.trace('SYSTEM', tracing.WARNING, None, None, '%s: dropped %d rows under backpressure', self.db_file, self.dropped)
+
+    def run(self):
+        #sqlite connections belong to the thread that made them, so the writer opens its own
+        conn = sql.connect(self.db_file)
+        conn.execute("PRAGMA synchronous=NORMAL")
 
+        while True:
+            rows = self.queue.get()
+            if rows is None:
+                break
+            try:
+                conn.executemany(self.insert, rows)
+                conn.commit()
+            except sql.Error:
+                tracing.trace('SYSTEM', tracing.ERROR, None, None, 'Query failure! Query was: %s', self.insert)
 
+        conn.close()
@@ -6,82 +6,334 @@ import data
 #specific imports needed for this module
 import entities
 import entitydata
+import scheduler
+import tracing
+import numpy
+from collections import OrderedDict
 
 
 class Maplevel(object):
+    TILE_GRIDS = ('blocked_map', 'transparent_map', 'explored_map')
+
     def __init__(self, height, width, levelnum, levelname):
         self.levelnum = levelnum
         self.levelname = levelname
         self.height = height
         self.width = width
 
-        self.map= [[ Tile(True)
-            for y in range(self.height) ]
-                for x in range(self.width) ]     
+        #tile data as contiguous arrays indexed [x, y]. everything starts out as solid, unexplored wall
+        self.blocked_map     = numpy.ones((self.width, self.height), dtype=bool)
+        self.transparent_map = numpy.zeros((self.width, self.height), dtype=bool)
+        self.explored_map    = numpy.zeros((self.width, self.height), dtype=bool)
+        self.explored_version = 0 #bumped when tiles get explored other than by being seen
 
-        self.fov_map = libtcod.map_new(self.width, self.height)
+        self.fov_map = None #tcod map. built on the first initialize_fov
+        self.fov_dirty = numpy.zeros((self.width, self.height), dtype=bool) #tiles changed since the last upload
+        self.lightable_cache = None
         self.fov_recompute = True
+        self.version = 0 #bumped whenever the fov map is rebuilt. cached fov results from older versions are stale
+        self.frozen_at = None #tick the level stopped being simulated, or None while it's live (see levelcache.py)
+        self.changes = 0 #bumped by every change to the tiles or the object index
+        self.record_cache = None #(record_key, bytes) of the last save record of this level. see savegame.level_record
+
+        #spatial index for the objects on this level. rebuilt on load by index_objects
+        self.clear_index()
+
+        #dijkstra distance maps toward the things monsters chase, shared by every monster on the level
+        self.flow_fields = OrderedDict()
+
+    def __getstate__(self):
+        #the index holds references into Game.objects, which is saved separately. don't pickle a second copy.
+        #the tcod map is a pointer into this process, so it gets rebuilt from the arrays instead
+        state = self.__dict__.copy()
+        del state['occupants']
+        del state['blockers']
+        del state['buckets']
+        del state['flow_fields']
+        state['fov_map'] = None
+        state['record_cache'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.frozen_at = None #older saves
+        self.changes = 0
+        self.record_cache = None
+        self.__dict__.update(state)
+        self.clear_index()
+        self.flow_fields = OrderedDict()
+
+    #save records keep the tile grids as packed bits (see savegame.py) and pickle only the rest
+    def record_state(self):
+        state = self.__getstate__()
+        for name in self.TILE_GRIDS + ('fov_dirty', 'lightable_cache'):
+            del state[name]
+        return state
+
+    def record_key(self):
+        #a frozen level only changes through the tile and index mutators, which bump changes. a live one can change
+        #any time something on it takes a turn, so it has no key and gets packed again on every save
+        if self.frozen_at is None:
+            return None
+        return (self.frozen_at, self.changes, self.explored_version)
+
+    def pack_tiles(self):
+        return pack_grids([getattr(self, name) for name in self.TILE_GRIDS])
+
+    def unpack_tiles(self, blob):
+        size = self.width * self.height
+        bits = numpy.unpackbits(numpy.frombuffer(blob, dtype=numpy.uint8))[:size * len(self.TILE_GRIDS)].astype(bool)
+        for (index, name) in enumerate(self.TILE_GRIDS):
+            setattr(self, name, bits[index * size:(index + 1) * size].reshape((self.width, self.height)))
+        self.fov_dirty = numpy.zeros((self.width, self.height), dtype=bool)
+        self.lightable_cache = None
 
     #functions to create matp shapes and rooms
+    def carve(self, x1, x2, y1, y2):
+        #make every tile in [x1, x2) x [y1, y2) passable and see-through
+        self.blocked_map[x1:x2, y1:y2] = False
+        self.transparent_map[x1:x2, y1:y2] = True
+        self.fov_dirty[x1:x2, y1:y2] = True
+        self.changes += 1
+
     def create_h_tunnel(self, x1, x2, y):
-        for x in range(min(x1, x2), max(x1, x2) + 1):
-            self.map[x][y].blocked = False
-            self.map[x][y].block_sight = False
+        self.carve(min(x1, x2), max(x1, x2) + 1, y, y + 1)
 
     def create_v_tunnel(self, y1, y2, x):
-        for y in range(min(y1, y2), max(y1, y2) + 1):
-            self.map[x][y].blocked = False
-            self.map[x][y].block_sight = False
+        self.carve(x, x + 1, min(y1, y2), max(y1, y2) + 1)
 
     def create_room(self, room):
-        #go through tiles in rect to make them passable
-        for x in range(room.x1 + 1, room.x2):
-            for y in range(room.y1 + 1, room.y2):
-                    self.map[x][y].blocked = False
-                    self.map[x][y].block_sight = False
+        #leave the outer ring of the rect as wall
+        self.carve(room.x1 + 1, room.x2, room.y1 + 1, room.y2)
 
     def blocked(self, x, y):
-        return self.map[x][y].blocked
+        return self.blocked_map[x, y]
 
     def block_sight(self, x, y):
-        return self.map[x][y].block_sight
+        return not self.transparent_map[x, y]
 
     def explored(self, x, y):
-        return self.map[x][y].explored
+        return self.explored_map[x, y]
 
     def set_explored(self, x, y):
-        self.map[x][y].explored = True
+        self.explored_map[x, y] = True
+        self.explored_version += 1
 
     def set_map_explored(self):
-        for y in range(self.height):
-            for x in range(self.width):
-                self.map[x][y].explored = True
+        self.explored_map.fill(True)
+        self.explored_version += 1
+
+    def lightable(self):
+        #tiles that can ever show up in fov: see-through tiles plus the walls touching them (walls are lit)
+        if self.lightable_cache is None or self.lightable_cache[0] != self.version:
+            lit = self.transparent_map.copy()
+            lit[1:, :] |= self.transparent_map[:-1, :]
+            lit[:-1, :] |= self.transparent_map[1:, :]
+            spread = lit.copy()
+            lit[:, 1:] |= spread[:, :-1]
+            lit[:, :-1] |= spread[:, 1:]
+            self.lightable_cache = (self.version, lit)
+        return self.lightable_cache[1]
+
+    def visible_in(self, fov, x0, y0, w, h):
+        #bool array [x, y] of the tiles of a w x h window at (x0, y0) that are in fov.
+        #tcod can only be asked one tile at a time, so only ask about tiles that could possibly be lit
+        visible = numpy.zeros((w, h), dtype=bool)
+        (xs, ys) = numpy.nonzero(self.lightable()[x0:x0 + w, y0:y0 + h])
+        for (x, y) in zip(xs.tolist(), ys.tolist()):
+            if libtcod.map_is_in_fov(fov, x0 + x, y0 + y):
+                visible[x, y] = True
+        return visible
+
+    #spatial index. occupants maps (x, y) to the objects on that tile (in draw order), blockers counts blocking objects per tile,
+    #buckets maps coarse (x, y) / SPATIAL_BUCKET_SIZE cells to the objects in them for radius queries
+    def clear_index(self):
+        self.occupants = {}
+        self.blockers = numpy.zeros((self.width, self.height), dtype=numpy.int16)
+        self.buckets = {}
+
+    def index_objects(self, objects):
+        self.clear_index()
+        for obj in objects:
+            self.add_object(obj)
+
+    def add_object(self, obj):
+        self.occupants.setdefault((obj.x, obj.y), []).append(obj)
+        self.buckets.setdefault((obj.x / data.SPATIAL_BUCKET_SIZE, obj.y / data.SPATIAL_BUCKET_SIZE), []).append(obj)
+        if obj.blocks:
+            self.blockers[obj.x, obj.y] += 1
+        self.changes += 1
+
+    def remove_object(self, obj):
+        bucket = self.occupants.get((obj.x, obj.y))
+        if bucket and obj in bucket:
+            bucket.remove(obj)
+            if not bucket:
+                del self.occupants[(obj.x, obj.y)]
+            if obj.blocks:
+                self.blockers[obj.x, obj.y] -= 1
+
+            cell = (obj.x / data.SPATIAL_BUCKET_SIZE, obj.y / data.SPATIAL_BUCKET_SIZE)
+            self.buckets[cell].remove(obj)
+            if not self.buckets[cell]:
+                del self.buckets[cell]
+            self.changes += 1
+
+    def move_object(self, obj, x, y):
+        self.remove_object(obj)
+        obj.x = x
+        obj.y = y
+        self.add_object(obj)
+
+    def set_blocks(self, obj, blocks):
+        #objects change blocks when they die. keep the counts right
+        if obj.blocks != blocks and obj in self.occupants.get((obj.x, obj.y), []):
+            if blocks:
+                self.blockers[obj.x, obj.y] += 1
+            else:
+                self.blockers[obj.x, obj.y] -= 1
+        obj.blocks = blocks
+        self.changes += 1
+
+    def send_to_back(self, obj):
+        bucket = self.occupants.get((obj.x, obj.y))
+        if bucket and obj in bucket:
+            bucket.remove(obj)
+            bucket.insert(0, obj)
+            self.changes += 1
+
+    def objects_at(self, x, y):
+        return self.occupants.get((x, y), [])
+
+    def is_occupied(self, x, y):
+        return self.blockers[x, y] > 0
+
+    def bucket_rings(self, x, y, radius):
+        #(min_dist, objects) for each ring of buckets around the one (x, y) is in, nearest ring first. ring r is every bucket
+        #r buckets away, and nothing in it is closer to (x, y) than min_dist. stops at the radius or the edge of the map,
+        #so a caller that already has something closer than min_dist can stop walking too
+        size = data.SPATIAL_BUCKET_SIZE
+        (cx, cy) = (x / size, y / size)
+        (ox, oy) = (x - cx * size, y - cy * size)
+        (last_x, last_y) = (self.width / size, self.height / size)
+
+        r = 0
+        while True:
+            if r == 0:
+                min_dist = 0
+            else: #the nearest tile of the ring is on its inner edge, on whichever side (x, y) sits closest to
+                min_dist = min(r * size - ox, ox + (r - 1) * size + 1, r * size - oy, oy + (r - 1) * size + 1)
+            if min_dist > radius or (cx - r < 0 and cy - r < 0 and cx + r > last_x and cy + r > last_y):
+                return
+
+            if r == 0:
+                ring = [(cx, cy)]
+            else: #top and bottom rows, then the left and right columns between them
+                ring = [(bx, by) for bx in range(cx - r, cx + r + 1) for by in (cy - r, cy + r)]
+                ring += [(bx, by) for bx in (cx - r, cx + r) for by in range(cy - r + 1, cy + r)]
+            objects = []
+            for cell in ring:
+                objects.extend(self.buckets.get(cell, ())) #cells off the map are never in buckets
+            yield (min_dist, objects)
+            r += 1
+
+    #flow fields. one dijkstra map per target, recomputed only when the target moves or the walls change
+    def flow_field(self, target):
+        if self.fov_map is None:
+            self.initialize_fov()
+
+        key = (target.x, target.y, self.version)
+        field = self.flow_fields.pop(target, None)
+        if field is None:
+            if len(self.flow_fields) >= data.FLOW_FIELD_CACHE_SIZE:
+                #reuse the least recently chased target's map
+                (oldtarget, field) = self.flow_fields.popitem(last=False)
+                field[1] = None
+            else:
+                field = [libtcod.dijkstra_new(self.fov_map), None]
+
+        if field[1] != key:
+            libtcod.dijkstra_compute(field[0], target.x, target.y)
+            field[1] = key
+
+        self.flow_fields[target] = field #most recently used goes to the end
+        return field[0]
+
+    def flow_step(self, obj, target):
+        #(dx, dy) of the free neighbouring tile closest to target by walking distance, or None if obj can't get any closer
+        dijkstra = self.flow_field(target)
+        best = libtcod.dijkstra_get_distance(dijkstra, obj.x, obj.y)
+        if best < 0: #no path at all
+            return None
+
+        step = None
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                (x, y) = (obj.x + dx, obj.y + dy)
+                if (dx or dy) and 0 <= x < self.width and 0 <= y < self.height and not self.blocked(x, y) and not self.is_occupied(x, y):
+                    distance = libtcod.dijkstra_get_distance(dijkstra, x, y)
+                    if 0 <= distance < best:
+                        (best, step) = (distance, (dx, dy))
+        return step
+
+    def clear_flow_fields(self):
+        for (dijkstra, key) in self.flow_fields.values():
+            libtcod.dijkstra_delete(dijkstra)
+        self.flow_fields.clear()
+
+    def release(self):
+        #free the native memory the level holds. call before dropping it. it can still be used after, things just get rebuilt
+        self.clear_flow_fields()
+        if self.fov_map is not None:
+            libtcod.map_delete(self.fov_map)
+            self.fov_map = None
 
     #map helper functions. create the fov map, go to next level, and lookup dungeon level percentages for objects
     def initialize_fov(self):
+        #bring the tcod map in line with the tile arrays. full upload the first time (or after a load), then dirty tiles only
         self.fov_recompute = True
 
-        for y in range(self.height):
-            for x in range(self.width):
-                libtcod.map_set_properties(self.fov_map, x, y, not self.block_sight(x, y), not self.blocked(x, y))
+        if self.fov_map is None:
+            self.fov_map = libtcod.map_new(self.width, self.height)
+            self.upload_fov()
+        elif self.fov_dirty.any():
+            self.upload_fov(self.fov_dirty)
+        else:
+            return #nothing changed. keep the map and every cached fov result
+
+        self.version += 1
+
+    def upload_fov(self, region=None):
+        #the ctypes wrapper has no call to set every cell at once. map_clear sets them all to the most common tile,
+        #then only the tiles that differ (or the dirty region) go through map_set_properties
+        walkable = ~self.blocked_map
+
+        if region is None:
+            common = int(numpy.count_nonzero(walkable)) * 2 > walkable.size
+            libtcod.map_clear(self.fov_map, walkable=common, transparent=common)
+            region = (walkable != common) | (self.transparent_map != common)
+
+        (xs, ys) = numpy.nonzero(region)
+        for (x, y) in zip(xs.tolist(), ys.tolist()):
+            libtcod.map_set_properties(self.fov_map, x, y, bool(self.transparent_map[x, y]), bool(walkable[x, y]))
+
+        self.fov_dirty.fill(False)
 
 
 def next_level(Game):
     #advance to next level
     message('You head down the stairs', Game, libtcod.red)
+    Game.map[Game.dungeon_levelname].remove_object(Game.player)
     Game.player.dungeon_level +=1
     Game.dungeon_levelname = data.maplist[Game.player.dungeon_level]
+    enter_level(Game)
 
-    if not Game.dungeon_levelname in Game.map:
-        make_map(Game, Game.player.dungeon_level, Game.dungeon_levelname) #create fresh new level
-
-    Game.player.x = Game.upstairs[Game.dungeon_levelname].x
-    Game.player.y = Game.upstairs[Game.dungeon_levelname].y
+    Game.map[Game.dungeon_levelname].move_object(Game.player, Game.upstairs[Game.dungeon_levelname].x, Game.upstairs[Game.dungeon_levelname].y)
     Game.map[Game.dungeon_levelname].initialize_fov()
 
 def prev_level(Game):
     #advance to next level
     message('You head up the stairs', Game, libtcod.red)
+    Game.map[Game.dungeon_levelname].remove_object(Game.player)
     Game.player.dungeon_level -=1
     Game.dungeon_levelname = data.maplist[Game.player.dungeon_level]
 
@@ -90,15 +342,29 @@ def prev_level(Game):
         Game.player.dungeon_level =1 #workaround to prevent game from complaining. 
         return data.STATE_EXIT
     else:
-        #make_map(Game) #create fresh new level
-        #assume map already made. bad long-term assumption
-        if not Game.dungeon_levelname in Game.map:
-            make_map(Game) #create fresh new level
+        enter_level(Game)
 
-        Game.player.x = Game.downstairs[Game.dungeon_levelname].x
-        Game.player.y = Game.downstairs[Game.dungeon_levelname].y
+        Game.map[Game.dungeon_levelname].move_object(Game.player, Game.downstairs[Game.dungeon_levelname].x, Game.downstairs[Game.dungeon_levelname].y)
         Game.map[Game.dungeon_levelname].initialize_fov()
 
+def pack_grids(grids):
+    #tile grids (TILE_GRIDS order) as one string of packed bits
+    return numpy.packbits(numpy.concatenate([grid.ravel() for grid in grids])).tostring()
+
+def release_levels(Game):
+    #before Game.map gets replaced (new game, load, end of a headless battle)
+    for level in Game.map.values():
+        level.release()
+
+def enter_level(Game):
+    #bring back (or freeze) levels around the player's new level, and make the new level if it was never visited
+    if Game.levels:
+        Game.levels.update(Game)
+    if not Game.dungeon_levelname in Game.map:
+        tracing.trace('MAPGEN', tracing.INFO, Game.tick, Game.dungeon_levelname, 'creating level %s', Game.dungeon_levelname)
+        make_map(Game, Game.player.dungeon_level, Game.dungeon_levelname) #create fresh new level
+        scheduler.schedule_level(Game, Game.dungeon_levelname)
+
 def from_dungeon_level(table, dungeon_level):
         #returns a value that depends on level. table specifies what value occurs after each level. default = 0
         for (value, level) in reversed(table):
@@ -107,26 +373,22 @@ def from_dungeon_level(table, dungeon_level):
         return 0
 
 def make_dungeon(Game):
-    for index,level in enumerate(data.maplist):
-        if index > 0: #skip intro level
-            print 'MAPGEN--\t ' + str(Game.tick) + '\t' + Game.dungeon_levelname + '\t' + ' creating level ' + level
-            Game.player.dungeon_level = index
-            Game.dungeon_levelname = level
-            make_map(Game, index, level)
-
+    #only the first level. the rest are made when the player first gets to them (see enter_level)
     Game.player.dungeon_level = 1
     Game.dungeon_levelname = data.maplist[Game.player.dungeon_level]
+    tracing.trace('MAPGEN', tracing.INFO, Game.tick, Game.dungeon_levelname, 'creating level %s', Game.dungeon_levelname)
+    make_map(Game, Game.player.dungeon_level, Game.dungeon_levelname)
 
-    Game.player.x = Game.upstairs[Game.dungeon_levelname].x
-    Game.player.y = Game.upstairs[Game.dungeon_levelname].y
+    Game.map[Game.dungeon_levelname].move_object(Game.player, Game.upstairs[Game.dungeon_levelname].x, Game.upstairs[Game.dungeon_levelname].y)
     Game.map[Game.dungeon_levelname].initialize_fov()
 
 #Primary map generator and object placement routines.
 def make_map(Game, levelnum, levelname):
+    Game.rng_mapgen = level_rng(Game, levelnum) #same seed, same level, no matter when it gets made
     Game.objects[Game.dungeon_levelname] = [Game.player]
     #fill map with "blocked" tiles
 
-    print 'MAPGEN--\t ' + str(Game.tick) + '\t' + Game.dungeon_levelname + '\t' + ' creating map:' + str(Game.dungeon_levelname)
+    tracing.trace('MAPGEN', tracing.INFO, Game.tick, Game.dungeon_levelname, 'creating map:%s', Game.dungeon_levelname)
     Game.map[Game.dungeon_levelname] = Maplevel(data.MAP_HEIGHT, data.MAP_WIDTH, levelnum, levelname)          
 
     rooms = []
@@ -134,11 +396,11 @@ def make_map(Game, levelnum, levelname):
 
     for r in range(data.MAX_ROOMS):
         #get random width/height
-        w = libtcod.random_get_int(0, data.ROOM_MIN_SIZE, data.ROOM_MAX_SIZE)
-        h = libtcod.random_get_int(0, data.ROOM_MIN_SIZE, data.ROOM_MAX_SIZE)
+        w = Game.rng_mapgen.randint(data.ROOM_MIN_SIZE, data.ROOM_MAX_SIZE)
+        h = Game.rng_mapgen.randint(data.ROOM_MIN_SIZE, data.ROOM_MAX_SIZE)
         #get random positions, but stay within map
-        x = libtcod.random_get_int(0, data.MAP_PAD_W, data.MAP_WIDTH - w - data.MAP_PAD_W)
-        y = libtcod.random_get_int(0, data.MAP_PAD_H, data.MAP_HEIGHT - h - data.MAP_PAD_H)
+        x = Game.rng_mapgen.randint(data.MAP_PAD_W, data.MAP_WIDTH - w - data.MAP_PAD_W)
+        y = Game.rng_mapgen.randint(data.MAP_PAD_H, data.MAP_HEIGHT - h - data.MAP_PAD_H)
 
         new_room = Rect(x, y, w, h)
 
@@ -165,6 +427,7 @@ def make_map(Game, levelnum, levelname):
                 #create upstairs at the center of the first room
                 Game.upstairs[Game.dungeon_levelname] = entities.Object(new_x, new_y, '<', 'upstairs', libtcod.white, always_visible = True)
                 Game.objects[Game.dungeon_levelname].append(Game.upstairs[Game.dungeon_levelname])
+                Game.map[Game.dungeon_levelname].add_object(Game.upstairs[Game.dungeon_levelname])
                 Game.upstairs[Game.dungeon_levelname].send_to_back(Game) #so it's drawn below the monsters
 
             else:
@@ -174,7 +437,7 @@ def make_map(Game, levelnum, levelname):
                 (prev_x, prev_y) = rooms[num_rooms -1].center()
 
                 #flip coin
-                if flip_coin() == 1:
+                if flip_coin(Game.rng_mapgen) == 1:
                     #move h then v
                     Game.map[Game.dungeon_levelname].create_h_tunnel(prev_x, new_x, prev_y)
                     Game.map[Game.dungeon_levelname].create_v_tunnel(prev_y, new_y, new_x)
@@ -190,6 +453,7 @@ def make_map(Game, levelnum, levelname):
     #create stairs at the center of the last room
     Game.downstairs[Game.dungeon_levelname] = entities.Object(new_x, new_y, '>', 'downstairs', libtcod.white, always_visible = True)
     Game.objects[Game.dungeon_levelname].append(Game.downstairs[Game.dungeon_levelname])
+    Game.map[Game.dungeon_levelname].add_object(Game.downstairs[Game.dungeon_levelname])
     Game.downstairs[Game.dungeon_levelname].send_to_back(Game) #so it's drawn below the monsters
 
     Game.map[Game.dungeon_levelname].initialize_fov()
@@ -200,23 +464,23 @@ def place_objects(room, Game):
     #max number monsters per room
     nextid = 1
     max_monsters = from_dungeon_level([[10, 1], [40, 3], [50, 6], [70, 10]], data.maplist.index(Game.dungeon_levelname))
-    num_monsters = libtcod.random_get_int(0, 0, max_monsters)
-    monster_chances = get_monster_chances(Game)
+    num_monsters = Game.rng_mapgen.randint(0, max_monsters)
+    monster_table = spawn_table(Game, 'monster')
 
     max_items = from_dungeon_level([[10, 1], [2, 4]], data.maplist.index(Game.dungeon_levelname))
-    num_items = libtcod.random_get_int(0, 0, max_items)
-    item_chances = get_item_chances(Game)
+    num_items = Game.rng_mapgen.randint(0, max_items)
+    item_table = spawn_table(Game, 'item')
 
     for i in range(num_monsters):
         #choose random spot for this monster
-        x =  libtcod.random_get_int(0, room.x1 + 1, room.x2 - 1)
-        y =  libtcod.random_get_int(0, room.y1 + 1, room.y2 - 1)
+        x =  Game.rng_mapgen.randint(room.x1 + 1, room.x2 - 1)
+        y =  Game.rng_mapgen.randint(room.y1 + 1, room.y2 - 1)
 
         if not entities.is_blocked(x, y, Game):
             #create a monster
-            choice = random_choice(monster_chances)
+            choice = monster_table.sample(Game.rng_mapgen)
 
-            monster             = entities.Object(**entitydata.mobs[choice])
+            monster             = entities.get_prototype(entitydata.mobs, choice).instantiate()
             monster.dungeon_level = data.maplist.index(Game.dungeon_levelname) 
             monster.blocks      = True        
             monster.ai          = entities.Ai(entities.BasicMonster())  #how do I set different ai?
@@ -226,38 +490,50 @@ def place_objects(room, Game):
             if data.FREE_FOR_ALL_MODE:
                 monster.fighter.clan        = monster.name
             nextid+=1
-            monster.fighter.fov = Game.map[Game.dungeon_levelname].fov_map
 
 
-            print 'MAPGEN--\t ' + str(Game.tick) + '\t' + Game.dungeon_levelname + '\t' + ' made a ' + monster.name
+            tracing.trace('MAPGEN', tracing.DEBUG, Game.tick, Game.dungeon_levelname, 'made a %s', monster.name)
 
             #give monster items if they have them
             if entitydata.mobitems[choice]:
                 for itemname in entitydata.mobitems[choice]:
-                    item = entities.Object(**entitydata.items[itemname])
+                    item = entities.get_prototype(entitydata.items, itemname).instantiate()
                     monster.fighter.add_item(item)
 
             monster.set_location(x, y, Game)
             Game.objects[Game.dungeon_levelname].append(monster)
 
+    #pick every item and its spot first, then spawn each kind in one go. items don't block, so placing one never changes where the next can go
+    item_spots = {}
     for i in range(num_items):
         #choose random spot for this item
-        x = libtcod.random_get_int(0, room.x1 + 1, room.x2 - 1)
-        y = libtcod.random_get_int(0, room.y1 + 1, room.y2 - 1)
+        x = Game.rng_mapgen.randint(room.x1 + 1, room.x2 - 1)
+        y = Game.rng_mapgen.randint(room.y1 + 1, room.y2 - 1)
 
         #only place it if the tile is not blocked
         if not entities.is_blocked(x, y,Game):
             #create an item
-            choice = random_choice(item_chances)
+            choice = item_table.sample(Game.rng_mapgen)
+            item_spots.setdefault(choice, []).append((x, y))
 
-            item = entities.Object(**entitydata.items[choice])
-            item.always_visible = True
+    for choice in sorted(item_spots):
+        for item in entities.spawn_many(entities.get_prototype(entitydata.items, choice), item_spots[choice], Game, always_visible=True):
+            item.send_to_back(Game) #items appear below other objects
 
-            item.set_location(x, y, Game)
-            item.dungeon_level = data.maplist.index(Game.dungeon_levelname)
+#compiled spawn tables, keyed by (kind, dungeon level). built on first use, cleared when the data is reloaded
+spawn_tables = {}
 
-            Game.objects[Game.dungeon_levelname].append(item)
-            item.send_to_back(Game) #items appear below other objects
+def spawn_table(Game, kind):
+    key = (kind, data.maplist.index(Game.dungeon_levelname))
+    if key not in spawn_tables:
+        if kind == 'monster':
+            spawn_tables[key] = AliasTable(get_monster_chances(Game))
+        else:
+            spawn_tables[key] = AliasTable(get_item_chances(Game))
+    return spawn_tables[key]
+
+def clear_spawn_tables():
+    spawn_tables.clear()
 
 def get_monster_chances(Game):
     #chance of each monster
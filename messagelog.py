@@ -0,0 +1,127 @@
+#standard imports
+import data
+
+#specific imports needed for this module
+import os
+import textwrap
+import cPickle as pickle
+from collections import deque
+
+
+class MessageLog(object):
+    #the messages shown in the panel. a ring of the last MSG_HEIGHT messages (each wraps to at least one line, so
+    #that's always enough to fill the panel). wrapping waits until a message is actually drawn, and happens once
+    def __init__(self, height=data.MSG_HEIGHT, width=data.MSG_WIDTH):
+        self.height = height
+        self.width = width
+        self.entries = deque(maxlen=height) #[text, color, wrapped lines or None]
+
+    def append(self, text, color):
+        self.entries.append([text, color, None])
+
+    def lines(self):
+        #(line, color) for the last height lines, oldest first
+        lines = []
+        for entry in reversed(self.entries):
+            if entry[2] is None:
+                entry[2] = textwrap.wrap(entry[0], self.width)
+            for line in reversed(entry[2]):
+                lines.append((line, entry[1]))
+                if len(lines) == self.height:
+                    return lines[::-1]
+        return lines[::-1]
+
+    def __getstate__(self):
+        return {'height': self.height, 'width': self.width, 'entries': [(text, color) for (text, color, wrapped) in self.entries]}
+
+    def __setstate__(self, state):
+        self.__init__(state['height'], state['width'])
+        for (text, color) in state['entries']:
+            self.append(text, color)
+
+
+class MessageHistory(object):
+    #every message the player was shown, for the 'p' log. the newest size messages stay in memory. when that fills up
+    #the oldest half is written out as a chunk file under path (or just dropped if path is None), and only max_chunks
+    #chunks are kept on disk. messages are numbered from 0 in the order they arrived. the ones still around are first..total-1
+    def __init__(self, size=data.MSG_HISTORY_SIZE, path=data.MSG_HISTORY_PATH, max_chunks=data.MSG_HISTORY_MAX_CHUNKS):
+        self.size = size
+        self.chunk_size = max(1, size / 2)
+        self.path = path
+        self.max_chunks = max_chunks
+        self.entries = [] #(turn, text, color), oldest first
+        self.total = 0
+        self.first = 0
+        self.chunks = deque() #start index of every chunk on disk, oldest first
+        self.cached = (None, None) #(start, entries) of the last chunk read back
+
+    def append(self, turn, text, color):
+        self.entries.append((turn, text, color))
+        self.total += 1
+        if len(self.entries) > self.size:
+            self.spill()
+
+    def spill(self):
+        chunk = self.entries[:self.chunk_size]
+        del self.entries[:self.chunk_size]
+        start = self.total - len(self.entries) - len(chunk)
+
+        if self.path is None:
+            self.first = start + len(chunk)
+            return
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        with open(self.chunk_file(start), 'wb') as file:
+            pickle.dump(chunk, file, pickle.HIGHEST_PROTOCOL)
+        self.chunks.append(start)
+
+        while len(self.chunks) > self.max_chunks:
+            oldest = self.chunks.popleft()
+            try:
+                os.remove(self.chunk_file(oldest))
+            except OSError:
+                pass
+            self.first = oldest + self.chunk_size
+
+    def chunk_file(self, start):
+        return os.path.join(self.path, 'messages.' + str(start))
+
+    def get(self, index):
+        #message number index, from memory or its chunk file
+        in_memory = self.total - len(self.entries)
+        if index >= in_memory:
+            return self.entries[index - in_memory]
+
+        start = self.chunks[0] + (index - self.chunks[0]) / self.chunk_size * self.chunk_size
+        if self.cached[0] != start:
+            with open(self.chunk_file(start), 'rb') as file:
+                self.cached = (start, pickle.load(file))
+        return self.cached[1][index - start]
+
+    def __len__(self):
+        return self.total - self.first
+
+    def pages(self, per_page, width=data.MSG_WIDTH):
+        #pages of per_page (turn, line, color) wrapped lines, most recent message first. messages are wrapped (and read
+        #back from disk) only as their page is reached, so looking at the first page doesn't touch the rest
+        page = []
+        for index in xrange(self.total - 1, self.first - 1, -1):
+            (turn, text, color) = self.get(index)
+            for line in textwrap.wrap(text, width) or ['']:
+                page.append((turn, line, color))
+                if len(page) == per_page:
+                    yield page
+                    page = []
+        if page or not len(self): #an empty log still gets its (empty) page
+            yield page
+
+    def __getstate__(self):
+        #spilled chunks belong to the running game, not the save. a load starts from what was still in memory
+        return {'size': self.size, 'path': self.path, 'max_chunks': self.max_chunks, 'entries': self.entries, 'total': self.total}
+
+    def __setstate__(self, state):
+        self.__init__(state['size'], state['path'], state['max_chunks'])
+        self.entries = state['entries']
+        self.total = state['total']
+        self.first = self.total - len(self.entries)
@@ -0,0 +1,279 @@
+#standard imports
+import data
+
+#specific imports needed for this module
+import os
+import struct
+import ctypes
+import hashlib
+import cPickle as pickle
+import threading
+import time
+import tracing
+from maplevel import Maplevel, release_levels, pack_grids
+
+
+#save store: a directory with one record per dungeon level, one for the player and the game-wide state,
+#and a manifest naming the current file of every record. a save only rewrites the records whose bytes changed.
+#records are written under new names and the manifest is swapped in last, so a crash mid-save leaves the old save intact
+MANIFEST = 'manifest'
+FORMAT = 2
+LEVEL_HEADER = struct.Struct('<4sIIII') #magic, width, height, tile bytes, object bytes
+
+def save(Game, path='savegame'):
+    #returns how many records had to be written
+    return write_records(snapshot(Game), path)
+
+def snapshot(Game):
+    #every record, as bytes or as a LevelSnapshot still to be packed. once this returns the game can carry on changing.
+    #runs between ticks on the main thread, so it does as little as it can: frozen levels hand over their cached record,
+    #live ones copy their tile grids and pickle their objects, and the packing is left to whoever writes the records
+    records = {'game': pack_game(Game)}
+    for (index, levelname) in enumerate(data.maplist):
+        if levelname in Game.map:
+            records['level' + str(index)] = level_record(Game, levelname)
+        elif Game.levels and levelname in Game.levels.evicted:
+            #read now, not by the writer: the level could be restored and evicted again before the writer gets to it
+            records['level' + str(index)] = Game.levels.record(levelname)
+    return records
+
+def write_records(records, path='savegame'):
+    #hash, write and fsync the records that changed, then swap in the new manifest
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    manifest = read_manifest(path) or {'format': FORMAT, 'records': {}, 'serial': 0}
+
+    written = 0
+    old_files = []
+    new_records = {}
+    for (name, record) in records.items():
+        blob = record_bytes(record)
+        digest = hashlib.md5(blob).hexdigest()
+        old = manifest['records'].get(name)
+        if old is not None and old[1] == digest and os.path.exists(os.path.join(path, old[0])):
+            new_records[name] = old #unchanged since the last save
+            continue
+
+        manifest['serial'] += 1
+        filename = name + '.' + str(manifest['serial'])
+        write_file(os.path.join(path, filename), blob)
+        new_records[name] = (filename, digest)
+        written += 1
+        if old is not None:
+            old_files.append(old[0])
+
+    #levels that no longer exist drop out of the manifest too
+    for (name, old) in manifest['records'].items():
+        if name not in new_records:
+            old_files.append(old[0])
+
+    if written or len(new_records) != len(manifest['records']):
+        manifest['records'] = new_records
+        write_file(os.path.join(path, MANIFEST), pickle.dumps(manifest, pickle.HIGHEST_PROTOCOL))
+
+        for filename in old_files:
+            try:
+                os.remove(os.path.join(path, filename))
+            except OSError:
+                pass
+
+    return written
+
+class Autosaver(object):
+    #periodic saves off the frame loop. the snapshot is taken between ticks on the main thread, the hashing, writing
+    #and fsyncing happen on a worker. if the last autosave is still being written, the next one is skipped
+    def __init__(self, path='savegame', interval=data.AUTOSAVE_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.last = time.time()
+        self.thread = None
+        self.error = None
+
+    def busy(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def tick(self, Game):
+        #call between ticks. starts an autosave when one is due
+        if self.interval and time.time() - self.last >= self.interval and not self.busy():
+            self.save(Game)
+
+    def save(self, Game):
+        self.wait()
+        self.last = time.time()
+        records = snapshot(Game)
+        self.thread = threading.Thread(target=self.write, args=(records,), name='autosave')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, records):
+        try:
+            write_records(records, self.path)
+        except (IOError, OSError) as e:
+            self.error = e
+            tracing.trace('SYSTEM', tracing.ERROR, None, None, 'autosave failed: %s', e)
+
+    def wait(self):
+        #block until the save in flight (if any) is on disk. call before saving or loading on the main thread
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+def load(Game, path='savegame', levels=None):
+    #with a LevelCache, levels too far from the player to be kept in memory go straight to its spill files
+    manifest = read_manifest(path)
+    if manifest is None:
+        raise IOError('no saved game in ' + path)
+
+    state = pickle.loads(read_file(path, manifest['records']['game'][0]))
+    Game.player = state['player']
+    Game.game_msgs = state['game_msgs']
+    Game.msg_history = state['msg_history']
+    Game.game_state = state['game_state']
+    Game.tick = state['tick']
+    Game.seed = state['seed']
+    Game.player.dungeon_level = state['dungeon_level']
+    Game.dungeon_levelname = data.maplist[Game.player.dungeon_level]
+
+    release_levels(Game)
+    Game.map = {}
+    Game.objects = {}
+    Game.upstairs = {}
+    Game.downstairs = {}
+    for (name, (filename, digest)) in manifest['records'].items():
+        if name.startswith('level'):
+            index = int(name[len('level'):])
+            if levels is not None and abs(index - Game.player.dungeon_level) >= data.LEVEL_EVICT_DISTANCE:
+                levels.spill(Game, data.maplist[index], read_file(path, filename))
+            else:
+                unpack_level(Game, read_file(path, filename))
+
+    #the player is saved once, not in every level's object list. put it back
+    for levelname in Game.objects:
+        Game.objects[levelname].insert(0, Game.player)
+        if levelname == Game.dungeon_levelname:
+            Game.map[levelname].add_object(Game.player)
+
+def pack_game(Game):
+    return pickle.dumps({
+        'player': Game.player,
+        'game_msgs': Game.game_msgs,
+        'msg_history': Game.msg_history,
+        'game_state': Game.game_state,
+        'tick': Game.tick,
+        'seed': Game.seed,
+        'dungeon_level': Game.player.dungeon_level
+    }, pickle.HIGHEST_PROTOCOL)
+
+def level_record(Game, levelname):
+    #save record of a level in memory. frozen levels reuse their last record until something changes them
+    level = Game.map[levelname]
+    key = level.record_key()
+    if key is not None and level.record_cache is not None and level.record_cache[0] == key:
+        return level.record_cache[1]
+    return LevelSnapshot(Game, levelname)
+
+def record_bytes(record):
+    if isinstance(record, str):
+        return record
+    return record.read()
+
+def pack_level(Game, levelname):
+    return LevelSnapshot(Game, levelname).read()
+
+class LevelSnapshot(object):
+    #a level as it was between two ticks. the tile grids are copied and everything else (level bookkeeping and the
+    #objects on it) is pickled right away, since the objects keep changing. bit packing the grids and laying out
+    #the record wait for read(), which the autosave worker calls
+    def __init__(self, Game, levelname):
+        level = Game.map[levelname]
+        objects = [object for object in Game.objects[levelname] if object is not Game.player]
+        state = {
+            'level': level.record_state(),
+            'objects': objects,
+            'upstairs': index_of(objects, Game.upstairs.get(levelname)),
+            'downstairs': index_of(objects, Game.downstairs.get(levelname))
+        }
+
+        self.level = level
+        self.key = level.record_key()
+        self.size = (level.width, level.height)
+        self.grids = [getattr(level, name).copy() for name in Maplevel.TILE_GRIDS]
+        self.pickled = pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+
+    def read(self):
+        tiles = pack_grids(self.grids)
+        blob = LEVEL_HEADER.pack('LVL1', self.size[0], self.size[1], len(tiles), len(self.pickled)) + tiles + self.pickled
+        if self.key is not None:
+            self.level.record_cache = (self.key, blob) #a frozen level. the next save can reuse this
+        return blob
+
+def unpack_level(Game, blob):
+    (magic, width, height, tile_bytes, object_bytes) = LEVEL_HEADER.unpack_from(blob)
+    if magic != 'LVL1':
+        raise IOError('not a level record')
+    start = LEVEL_HEADER.size
+    state = pickle.loads(blob[start + tile_bytes:start + tile_bytes + object_bytes])
+
+    level = Maplevel.__new__(Maplevel)
+    level.__setstate__(state['level'])
+    level.unpack_tiles(blob[start:start + tile_bytes])
+
+    objects = state['objects']
+    Game.map[level.levelname] = level
+    Game.objects[level.levelname] = objects
+    level.index_objects(objects)
+    if state['upstairs'] is not None:
+        Game.upstairs[level.levelname] = objects[state['upstairs']]
+    if state['downstairs'] is not None:
+        Game.downstairs[level.levelname] = objects[state['downstairs']]
+
+def index_of(objects, object):
+    if object is None:
+        return None
+    return objects.index(object)
+
+def read_manifest(path):
+    try:
+        manifest = pickle.loads(read_file(path, MANIFEST))
+    except (IOError, OSError, EOFError, pickle.UnpicklingError):
+        return None
+    if manifest.get('format') != FORMAT:
+        return None
+    return manifest
+
+def read_file(path, filename):
+    with open(os.path.join(path, filename), 'rb') as file:
+        return file.read()
+
+def write_file(filename, blob, sync=True):
+    #write to a temp file, flush it to disk, then swap it in for the real one. readers only ever see a whole file
+    temp = filename + '.tmp'
+    with open(temp, 'wb') as file:
+        file.write(blob)
+        if sync:
+            file.flush()
+            os.fsync(file.fileno())
+    replace_file(temp, filename, sync)
+
+MOVEFILE_REPLACE_EXISTING = 0x1
+MOVEFILE_WRITE_THROUGH = 0x8
+
+def replace_file(source, destination, sync=True):
+    #atomic rename over an existing file. a crash leaves either the old file or the new one, never neither
+    if os.name == 'nt':
+        #os.rename won't replace an existing file on windows, and remove-then-rename has a window with no file at all
+        flags = MOVEFILE_REPLACE_EXISTING
+        if sync:
+            flags |= MOVEFILE_WRITE_THROUGH
+        if not ctypes.windll.kernel32.MoveFileExW(unicode(source), unicode(destination), flags):
+            raise ctypes.WinError()
+        return
+
+    os.rename(source, destination)
+    if sync:
+        #the rename itself only sticks once the directory entry is on disk
+        directory = os.open(os.path.dirname(destination) or '.', os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
@@ -0,0 +1,80 @@
+#standard imports
+import data
+
+#specific imports needed for this module
+import heapq
+
+
+class Scheduler(object):
+    #event queue keyed by the tick an event is due: fighter turns, regen and buff expiry.
+    #the engine pops whatever is due instead of counting down every entity every tick
+    def __init__(self):
+        self.queue = []
+        self.counter = 0 #tie breaker. events due on the same tick run in the order they were scheduled
+
+    def schedule(self, tick, kind, object, thing=None):
+        self.counter += 1
+        heapq.heappush(self.queue, (tick, self.counter, kind, object, thing))
+
+    def next_tick(self):
+        #tick of the next pending event, or None if nothing is scheduled
+        if self.queue:
+            return self.queue[0][0]
+        return None
+
+    def pop_due(self, tick):
+        #yield (kind, object, thing) for every event due on or before tick, including ones scheduled while we go
+        while self.queue and self.queue[0][0] <= tick:
+            (due, count, kind, object, thing) = heapq.heappop(self.queue)
+            yield (kind, object, thing)
+
+    def drop(self, wanted):
+        #remove every event whose object wanted() picks. used to take a whole level out of the simulation
+        self.queue = [event for event in self.queue if not wanted(event[3])]
+        heapq.heapify(self.queue)
+
+    def __len__(self):
+        return len(self.queue)
+
+
+def schedule_fighter(Game, object):
+    #queue the next turn, regen and buff expiries for a fighter. used for fresh monsters and after loading
+    fighter = object.fighter
+    if Game.fighter_store is not None:
+        Game.fighter_store.attach(fighter)
+    if fighter.next_regen is None:
+        fighter.next_regen = Game.tick + fighter.regen(Game)
+    if fighter.next_turn < Game.tick:
+        fighter.next_turn = Game.tick
+
+    Game.scheduler.schedule(fighter.next_turn, data.EVENT_TURN, object)
+    Game.scheduler.schedule(fighter.next_regen, data.EVENT_REGEN, object)
+
+    if fighter.buffs:
+        for buff in fighter.buffs:
+            if buff.expires is not None:
+                Game.scheduler.schedule(buff.expires, data.EVENT_BUFF, object, buff)
+
+def schedule_buff(Game, object, buff):
+    #buffs lose decay_rate per tick, counting the tick they were applied on. decay_rate 0 never wears off
+    if buff.decay_rate > 0:
+        buff.expires = Game.tick + (buff.duration + buff.decay_rate - 1) / buff.decay_rate - 1
+        Game.scheduler.schedule(buff.expires, data.EVENT_BUFF, object, buff)
+
+def schedule_level(Game, levelname):
+    #queue every fighter on one level. the player sits in every level's object list, so it is left to schedule_all
+    for object in Game.objects[levelname]:
+        if object is Game.player:
+            continue
+        if object.fighter:
+            schedule_fighter(Game, object)
+        elif object.ai:
+            Game.scheduler.schedule(Game.tick, data.EVENT_TURN, object)
+
+def schedule_all(Game):
+    #rebuild the queue from scratch for every fighter on every level that isn't frozen (see levelcache.py)
+    Game.scheduler = Scheduler()
+    schedule_fighter(Game, Game.player)
+    for index,levelname in enumerate(data.maplist):
+        if index > 0 and levelname in Game.objects and Game.map[levelname].frozen_at is None: #skip intro level
+            schedule_level(Game, levelname)
@@ -0,0 +1,265 @@
+#standard imports
+import libtcodpy as libtcod
+from gamestuff import *
+import data
+
+#specific imports needed for this module
+import entities
+import maplevel
+import logging
+import scheduler
+import fovcache
+import components
+import levelcache
+import messagelog
+import tracing
+import contextlib
+
+
+#headless game state. stands in for the Game class in Dungeoneer.py so the same
+#tick logic can run with no console, no window and no fps cap
+class Simulation(object):
+    def __init__(self, seed=None, log_sql=False, verbose=False):
+        #battle royale: everyone on their own clan, no player. the tick logic reads these from data, so they are
+        #set there while the simulation is doing something (see data_modes) and put back afterwards
+        self.modes = {'AUTOMODE': True, 'FREE_FOR_ALL_MODE': True, 'PRINT_MESSAGES': verbose}
+        with self.data_modes():
+            self.setup(seed, log_sql)
+
+    @contextlib.contextmanager
+    def data_modes(self):
+        #safe to nest. each level puts back what it found
+        saved = dict((name, getattr(data, name)) for name in self.modes)
+        for (name, value) in self.modes.items():
+            setattr(data, name, value)
+        try:
+            yield
+        finally:
+            for (name, value) in saved.items():
+                setattr(data, name, value)
+
+    def setup(self, seed, log_sql):
+        new_rng_streams(self, seed) #sets self.seed, picking one if none was given
+
+        self.game_msgs = messagelog.MessageLog()
+        self.msg_history = messagelog.MessageHistory(path=None) #parallel battles would share the spill directory
+        self.map = {}
+        self.objects = {}
+        self.upstairs = {}
+        self.downstairs = {}
+        self.tick = 0
+        self.fov_recompute = False
+        self.fov_cache = fovcache.FovCache()
+        self.levels = levelcache.LevelCache()
+        self.fighter_store = None
+        if data.FIGHTER_STORE:
+            self.fighter_store = components.FighterStore()
+        self.game_state = data.STATE_PLAYING
+
+        self.entity_sql = None
+        self.message_sql = None
+        self.sql_commit_counter = data.SQL_COMMIT_TICK_COUNT
+
+        #placeholder player. dead from the start, same as new_game does in FREE_FOR_ALL_MODE
+        fighter_component = entities.Fighter(hp=0, defense=0, power=0, xp=0, xpvalue=0, clan='player', death_function=entities.player_death)
+        self.player = entities.Object(0, 0, '@', 'nobody', libtcod.white, blocks=True, fighter=fighter_component)
+        self.player.fighter.alive = False
+        self.player.dungeon_level = 1
+        self.player.game_turns = 0
+        self.dungeon_levelname = data.maplist[self.player.dungeon_level]
+
+        if log_sql:
+            self.entity_sql = logging.Sqlobj(data.ENTITY_DB)
+            self.message_sql = logging.Sqlobj(data.MESSAGE_DB)
+
+        maplevel.make_dungeon(self)
+        self.tick = 1
+        scheduler.schedule_all(self)
+
+        self.player.fighter.fov_recompute(self)
+        self.player.fighter.death_function(self.player, None, self)
+
+    def step(self):
+        #jump straight to the next tick with something due, run it, and return the entities still alive afterwards
+        with self.data_modes():
+            next_tick = self.scheduler.next_tick()
+            if next_tick is not None and next_tick > self.tick:
+                self.tick = next_tick
+            process_tick(self)
+            return entities.total_alive_entities(self)
+
+    def run(self, max_ticks):
+        alive_entities = entities.total_alive_entities(self)
+        while self.tick <= max_ticks and len(alive_entities) > 1:
+            alive_entities = self.step()
+
+        if self.entity_sql:
+            for object in self.objects[self.dungeon_levelname]:
+                if object.fighter:
+                    self.entity_sql.log_entity(self, object)
+            self.entity_sql.close()
+            self.message_sql.close()
+            self.entity_sql = self.message_sql = None
+        tracing.flush()
+        self.fov_cache.clear() #tournament workers run battle after battle in one process
+        maplevel.release_levels(self)
+
+        return self.results(alive_entities)
+
+    def results(self, alive_entities):
+        winner = None
+        if len(alive_entities) == 1:
+            winner = alive_entities[0].name
+
+        stats = []
+        for levelname in self.objects:
+            for object in self.objects[levelname]:
+                if object.fighter and object is not self.player:
+                    stats.append({
+                        'name': object.name,
+                        'kind': object.name.split('(')[0], #monster names are kind(id)
+                        'dungeon_level': object.dungeon_level,
+                        'alive': object.fighter.alive,
+                        'hp': object.fighter.hp,
+                        'xp': object.fighter.xp,
+                        'xplevel': object.fighter.xplevel,
+                        'power': object.fighter.power(self),
+                        'defense': object.fighter.defense(self),
+                        'kills': object.fighter.kills,
+                        'survived': object.fighter.death_tick or self.tick - 1 #tick it died on, or the last tick if it made it to the end
+                    })
+
+        return {
+            'seed': self.seed,
+            'winner': winner,
+            'ticks': self.tick - 1,
+            'survivors': [object.name for object in alive_entities],
+            'stats': stats
+        }
+
+
+def run_battle(seed=None, max_ticks=10000, log_sql=False, verbose=False):
+    #run a single headless Battle Royale and return the winner and stats
+    return Simulation(seed, log_sql, verbose).run(max_ticks)
+
+
+#per-tick world logic. shared by play_game and Simulation
+def process_tick(Game):
+    #only the entities with something due this tick do any work
+    regens = []
+    for (kind, object, thing) in Game.scheduler.pop_due(Game.tick):
+        if kind == data.EVENT_REGEN and Game.fighter_store is not None and object.fighter and object.fighter.store is Game.fighter_store:
+            regens.append(object) #done all at once below
+        else:
+            process_event(Game, kind, object, thing)
+
+    if regens:
+        regen_batch(Game, regens)
+
+    if data.FREE_FOR_ALL_MODE:
+        if Game.entity_sql:
+            Game.entity_sql.log_flush(Game)
+            Game.message_sql.log_flush(Game)
+        if Game.sql_commit_counter <= 0:
+            Game.sql_commit_counter = data.SQL_COMMIT_TICK_COUNT
+        Game.sql_commit_counter -= 1
+
+    Game.tick += 1
+    Game.dungeon_levelname = data.maplist[Game.player.dungeon_level]
+
+def process_event(Game, kind, object, thing=None):
+    #each event runs with the level of the object it belongs to as the current level
+    Game.dungeon_levelname = data.maplist[object.dungeon_level]
+    fighter = object.fighter
+
+    if fighter is None:
+        #ai without a fighter component gets a turn every tick
+        if object.ai:
+            object.ai.take_turn(Game)
+            Game.scheduler.schedule(Game.tick + 1, data.EVENT_TURN, object)
+        return
+
+    if not fighter.alive: #dead fighters drop out of the queue
+        return
+
+    if kind == data.EVENT_TURN:
+        if object.ai:
+            if object.ai.take_turn(Game): #only schedule another turn if monster is still alive
+                fighter.next_turn = Game.tick + max(1, fighter.speed(Game))
+                Game.scheduler.schedule(fighter.next_turn, data.EVENT_TURN, object)
+        else:
+            #no ai (the player): play_game sets next_turn when the player acts. keep polling in case an ai gets attached
+            Game.scheduler.schedule(Game.tick + 1, data.EVENT_TURN, object)
+
+    elif kind == data.EVENT_REGEN:
+        fighter.hp += int(fighter.max_hp(Game) * data.REGEN_MULTIPLIER)
+        fighter.next_regen = Game.tick + max(1, fighter.regen(Game))
+        Game.scheduler.schedule(fighter.next_regen, data.EVENT_REGEN, object)
+
+    elif kind == data.EVENT_BUFF:
+        if fighter.buffs and thing in fighter.buffs:
+            thing.duration = 0
+            message(object.name + ' feels the effects of ' + thing.name + ' wear off!', Game, libtcod.light_red)
+            fighter.remove_buff(thing)
+
+    #this is clunky, but have to again check if monster is still alive
+    if fighter.alive:
+        #always check to ensure hp <= max_hp
+        if fighter.hp > fighter.max_hp(Game):
+            fighter.hp = fighter.max_hp(Game)
+
+        check_level_up(Game, object)
+
+    if data.FREE_FOR_ALL_MODE and Game.entity_sql:
+        # log object state
+        Game.entity_sql.log_entity(Game, object)
+
+def regen_batch(Game, objects):
+    #EVENT_REGEN for every fighter in objects as array ops on the fighter store, then the per-fighter bookkeeping
+    living = [object for object in objects if object.fighter.alive]
+    if not living:
+        return
+
+    Game.fighter_store.regen_batch(Game, [object.fighter.slot for object in living])
+
+    for object in living:
+        Game.dungeon_levelname = data.maplist[object.dungeon_level]
+        Game.scheduler.schedule(object.fighter.next_regen, data.EVENT_REGEN, object)
+        check_level_up(Game, object)
+        if data.FREE_FOR_ALL_MODE and Game.entity_sql:
+            Game.entity_sql.log_entity(Game, object)
+
+def check_level_up(Game, user):
+    #see if the user's experience is enough to level-up
+
+        level_up_xp = data.LEVEL_UP_BASE + user.fighter.xplevel * data.LEVEL_UP_FACTOR
+
+        if user.fighter.xp >= level_up_xp:
+            user.fighter.xplevel += 1
+            user.fighter.xp -= level_up_xp
+
+            if user is Game.player:
+                message('You have reached level ' + str(user.fighter.xplevel) + '!', Game, libtcod.yellow)
+            else:
+                message(user.name + ' has reached level ' + str(user.fighter.xplevel) + '!', Game, libtcod.yellow)
+
+            choice = None
+
+            if user is Game.player:
+                while choice == None: #keep asking till a choice is made
+                        choice = menu('Level up! Choose a stat to raise:\n',
+                        [Menuobj('Constitution (+25 HP, from ' + str(Game.player.fighter.max_hp(Game)) + ')',color=libtcod.green),
+                        Menuobj('Strength (+2 attack, from ' + str(Game.player.fighter.power(Game)) + ')', color=libtcod.red),
+                        Menuobj('Defense (+2 defense, from ' + str(Game.player.fighter.defense(Game)) + ')', color=libtcod.blue)], data.LEVEL_SCREEN_WIDTH, Game, letterdelim=')')
+            else:
+                choice = Game.rng_combat.randint(0,2)
+
+            if choice == 0:
+                user.fighter.base_max_hp += 25
+            elif choice == 1:
+                user.fighter.base_power += 2
+            elif choice == 2:
+                user.fighter.base_defense += 2
+
+            user.fighter.invalidate_stats()
+            user.fighter.hp = user.fighter.max_hp(Game)
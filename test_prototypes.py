@@ -0,0 +1,45 @@
+#run from this directory: python -m unittest test_prototypes
+import unittest
+
+import entities
+import entitydata
+
+
+class PrototypeTest(unittest.TestCase):
+    #every entitydata entry has to survive being compiled to a Prototype and copied. a component class that
+    #clone() can't copy breaks every spawn of whatever uses it
+    def setUp(self):
+        entities.clear_prototypes()
+
+    def check_table(self, table):
+        for name in table:
+            prototype = entities.get_prototype(table, name)
+            obj = prototype.instantiate(name=name)
+            self.assertEqual(obj.name, name)
+
+            for component in entities.Prototype.COMPONENTS:
+                original = getattr(prototype.template, component)
+                copy = getattr(obj, component)
+                if original is None:
+                    self.assertIsNone(copy)
+                else:
+                    self.assertIsNot(copy, original, name + ' shares its ' + component + ' with the prototype')
+                    self.assertIs(copy.owner, obj)
+
+    def test_mobs(self):
+        self.check_table(entitydata.mobs)
+
+    def test_items(self):
+        self.check_table(entitydata.items)
+
+    def test_copies_are_independent(self):
+        prototype = entities.get_prototype(entitydata.mobs, 'johnstein')
+        (first, second) = (prototype.instantiate(), prototype.instantiate())
+        first.fighter.hp -= 1
+        first.caster.mp -= 1
+        self.assertEqual(second.fighter.hp, prototype.template.fighter.hp)
+        self.assertEqual(second.caster.mp, prototype.template.caster.mp)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+#standard imports
+import simulation
+import tracing
+
+#specific imports needed for this module
+import argparse
+import multiprocessing
+
+
+#run lots of seeded headless Battle Royales across every core and boil them down to one report.
+#   python tournament.py --battles 1000 --workers 8 --seed 1
+#every battle is independent, so the pool just hands out seeds and the parent only aggregates
+
+def init_worker(verbose):
+    #mapgen and message traces from a few thousand battles are useless, and slow the workers down.
+    #the null sink switches them off before any of them get formatted
+    if not verbose:
+        tracing.configure(tracing.NullSink())
+
+def run_one(args):
+    (seed, max_ticks, verbose) = args
+    return simulation.run_battle(seed=seed, max_ticks=max_ticks, verbose=verbose)
+
+def run_tournament(battles, workers=None, first_seed=1, max_ticks=10000, verbose=False):
+    #results come back in whatever order they finish, each tagged with its seed
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    jobs = [(seed, max_ticks, verbose) for seed in range(first_seed, first_seed + battles)]
+    chunksize = max(1, battles / (workers * 4)) #few enough round trips to the parent, small enough to keep every worker busy
+
+    pool = multiprocessing.Pool(workers, init_worker, (verbose,))
+    try:
+        results = list(pool.imap_unordered(run_one, jobs, chunksize))
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return aggregate(results)
+
+def aggregate(results):
+    #per kind of monster: how many entered, how many won, average ticks survived and average kills
+    kinds = {}
+    for result in results:
+        for stats in result['stats']:
+            kind = kinds.setdefault(stats['kind'], {'entries': 0, 'wins': 0, 'survived': 0, 'kills': 0})
+            kind['entries'] += 1
+            kind['survived'] += stats['survived']
+            kind['kills'] += stats['kills']
+            if result['winner'] == stats['name']:
+                kind['wins'] += 1
+
+    for kind in kinds.values():
+        kind['avg_survived'] = float(kind['survived']) / kind['entries']
+        kind['avg_kills'] = float(kind['kills']) / kind['entries']
+
+    battles = len(results)
+    return {
+        'battles': battles,
+        'no_winner': len([result for result in results if result['winner'] is None]),
+        'avg_ticks': float(sum(result['ticks'] for result in results)) / max(1, battles),
+        'kinds': kinds,
+        'results': sorted(results, key=lambda result: result['seed'])
+    }
+
+def print_report(report):
+    print 'battles: ' + str(report['battles']) + '\tno winner: ' + str(report['no_winner']) + '\tavg ticks: ' + '%.1f' % report['avg_ticks']
+    print '%-20s %8s %6s %8s %12s %10s' % ('kind', 'entries', 'wins', 'win %', 'avg survived', 'avg kills')
+
+    for (name, kind) in sorted(report['kinds'].items(), key=lambda item: -item[1]['wins']):
+        print '%-20s %8d %6d %7.1f%% %12.1f %10.2f' % (name, kind['entries'], kind['wins'], 100.0 * kind['wins'] / kind['entries'],
+            kind['avg_survived'], kind['avg_kills'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run many headless Battle Royales in parallel and report who wins.')
+    parser.add_argument('--battles', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the first battle. battle n uses seed + n')
+    parser.add_argument('--max-ticks', type=int, default=10000)
+    parser.add_argument('--verbose', action='store_true', help='let workers print game messages')
+    args = parser.parse_args()
+
+    print_report(run_tournament(args.battles, args.workers, args.seed, args.max_ticks, args.verbose))
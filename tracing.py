@@ -0,0 +1,156 @@
+#standard imports
+import data
+
+#specific imports needed for this module
+import sys
+import sqlite3 as sql
+from collections import deque
+import logging
+
+
+#tagged trace lines ('MSG--', 'MAPGEN--', 'SYSTEM--', ...) go through here instead of straight to print.
+#every category has a level threshold (data.TRACE_LEVELS, anything not listed uses data.TRACE_DEFAULT_LEVEL).
+#below it, trace() returns before anything gets formatted, so call sites pass format arguments, not built strings:
+#   tracing.trace('MAPGEN', tracing.DEBUG, Game.tick, levelname, 'made a %s', monster.name)
+#where the events end up is up to the sink: null, stdout, a buffered file, sqlite or an in-memory ring
+DEBUG   = 10
+INFO    = 20
+WARNING = 30
+ERROR   = 40
+OFF     = 100
+
+thresholds = dict(data.TRACE_LEVELS)
+default_level = data.TRACE_DEFAULT_LEVEL
+
+
+def format_event(category, level, tick, where, text):
+    #same layout the old prints used. events that don't belong to a tick or level leave those columns out
+    if tick is None:
+        return category + '--\t ' + text
+    return category + '--\t ' + str(tick) + '\t' + str(where) + '\t ' + text
+
+
+class NullSink(object):
+    #throws everything away. configure() also switches every category off with it, so nothing even gets formatted
+    def write(self, category, level, tick, where, text):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class StreamSink(NullSink):
+    #one line per event, like the prints this replaced. looks sys.stdout up every time so redirecting it still works
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def write(self, category, level, tick, where, text):
+        (self.stream or sys.stdout).write(format_event(category, level, tick, where, text) + '\n')
+
+
+class FileSink(NullSink):
+    #lines pile up in memory and get written buffer_size at a time
+    def __init__(self, filename=data.TRACE_FILE, buffer_size=data.TRACE_BUFFER_SIZE):
+        self.file = open(filename, 'a')
+        self.buffer_size = buffer_size
+        self.lines = []
+
+    def write(self, category, level, tick, where, text):
+        self.lines.append(format_event(category, level, tick, where, text) + '\n')
+        if len(self.lines) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            self.file.writelines(self.lines)
+            self.lines = []
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class SqlSink(NullSink):
+    #buffered rows handed to a logging.SqlWriter thread, buffer_size at a time
+    def __init__(self, db_file=data.TRACE_DB, buffer_size=data.TRACE_BUFFER_SIZE):
+        conn = sql.connect(db_file)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS trace (category TEXT, level INT, tick INT, location TEXT, text TEXT)")
+        conn.close()
+
+        self.buffer_size = buffer_size
+        self.rows = []
+        self.writer = logging.SqlWriter(db_file, "INSERT INTO trace(category, level, tick, location, text) VALUES (?, ?, ?, ?, ?)")
+
+    def write(self, category, level, tick, where, text):
+        self.rows.append((category, level, tick, where, text))
+        if len(self.rows) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.writer.put(self.rows)
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+class RingSink(NullSink):
+    #keeps only the last size events, unformatted. for looking at what led up to something
+    def __init__(self, size=data.TRACE_RING_SIZE):
+        self.events = deque(maxlen=size)
+
+    def write(self, category, level, tick, where, text):
+        self.events.append((category, level, tick, where, text))
+
+    def lines(self):
+        return [format_event(*event) for event in self.events]
+
+
+SINKS = {'null': NullSink, 'stream': StreamSink, 'file': FileSink, 'sqlite': SqlSink, 'ring': RingSink}
+
+sink = StreamSink() #until configure() is called
+
+
+def trace(category, level, tick, where, text, *args):
+    #text % args, only worked out if the category lets this level through
+    if level < thresholds.get(category, default_level):
+        return
+    if args:
+        text = text % args
+    sink.write(category, level, tick, where, text)
+
+def enabled(category, level=INFO):
+    #for call sites that have to do real work to build their arguments
+    return level >= thresholds.get(category, default_level)
+
+def configure(new_sink=None, levels=None, default=None):
+    #swap in a sink (an instance, or a name out of SINKS) and levels. defaults come from data.TRACE_*
+    global sink, thresholds, default_level
+    if new_sink is None:
+        new_sink = data.TRACE_SINK
+    if isinstance(new_sink, basestring):
+        new_sink = SINKS[new_sink]()
+
+    sink.close()
+    sink = new_sink
+    thresholds = dict(data.TRACE_LEVELS if levels is None else levels)
+    default_level = data.TRACE_DEFAULT_LEVEL if default is None else default
+    if type(sink) is NullSink:
+        thresholds = {}
+        default_level = OFF #the cheapest path: every trace() stops at the threshold check
+
+def flush():
+    sink.flush()
+
+def close():
+    #flush and let go of the sink. traces after this go to stdout
+    global sink
+    sink.close()
+    sink = StreamSink()